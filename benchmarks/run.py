@@ -0,0 +1,159 @@
+"""Benchmark the calibration pipeline on a synthetic experiment
+
+    python -m benchmarks.run --standin --antennas 8 --spws 8 --steps convert_flag flag_data
+
+Results are appended to a JSON-lines file together with the git commit,
+and compared with the latest result of another commit for the same
+configuration.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+from . import synthetic
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=here,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config, steps=None, repeat=1, standin=True, root=None, **run_kwargs):
+    """Generate a synthetic experiment and time the pipeline on it
+
+    Parameters
+    ----------
+        config: dict
+            keyword arguments of synthetic.make_experiment
+        steps: list
+            steps to be run (default: all)
+        repeat: int
+            number of timed runs, the fastest one is kept per step
+        standin: bool
+            use the stand-in CASA modules (default: True)
+        root: str
+            directory for the synthetic data (default: temporary directory)
+
+    Returns
+    -------
+        dict: per step wall time [s], fastest of the repeats
+    """
+    if standin:
+        from . import standin as _standin
+
+        _standin.install()
+
+    root = root or tempfile.mkdtemp(prefix="casa_evn_bench_")
+    experiment = config.get("experiment", "bench")
+    start = time.perf_counter()
+    workdir = synthetic.make_experiment(root, **config)
+    elapsed = time.perf_counter() - start
+    print(f"Synthetic experiment written to {root} in {elapsed:.1f} s")
+
+    # calibration resolves its directories from the working directory on import
+    os.chdir(workdir)
+    from casa_evn import calibration, instrument
+
+    steps = steps or calibration.get_steps()
+    timings = {}
+    for _ in range(repeat):
+        first_record = len(instrument.records)
+        calibration.run_steps(experiment, steps, force=True, **run_kwargs)
+        for r in instrument.records[first_record:]:
+            if r["kind"] == "step":
+                best = timings.get(r["name"], r["wall_s"])
+                timings[r["name"]] = min(best, r["wall_s"])
+    return timings
+
+
+def compare(results, result):
+    """Print the ratio to the latest result of another commit"""
+    previous = [
+        r
+        for r in results
+        if r["config"] == result["config"]
+        and r["standin"] == result["standin"]
+        and r["commit"] != result["commit"]
+    ]
+    if not previous:
+        print("No result of another commit to compare with")
+        return
+    ref = previous[-1]
+    print(f"Compared with {ref['commit']} ({ref['date']})")
+    for step, t in result["timings"].items():
+        t0 = ref["timings"].get(step)
+        ratio = f"{t / t0:6.2f}x" if t0 else "     -"
+        print(f"{step:<28}{t0 if t0 is not None else '-':>10}{t:>10} {ratio}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the calibration pipeline")
+    parser.add_argument("--antennas", type=int, default=6)
+    parser.add_argument("--spws", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=32)
+    parser.add_argument("--inttime", type=float, default=2.0, help="[s]")
+    parser.add_argument("--duration", type=float, default=600.0, help="[s]")
+    parser.add_argument("--files", type=int, default=2, help="number of IDI files")
+    parser.add_argument("--flags", type=int, default=200, help="UVFLG entries")
+    parser.add_argument("-s", "--steps", nargs="+", type=str, default=None)
+    parser.add_argument("-r", "--repeat", type=int, default=1)
+    parser.add_argument(
+        "--standin", action="store_true", help="use stand-ins for the CASA tasks"
+    )
+    parser.add_argument("--root", type=str, default=None, help="data directory")
+    parser.add_argument(
+        "--results",
+        type=str,
+        default=f"{here}/results.jsonl",
+        help="JSON-lines file the results are appended to",
+    )
+    args = parser.parse_args()
+
+    config = {
+        "nant": args.antennas,
+        "nspw": args.spws,
+        "nchan": args.channels,
+        "inttime": args.inttime,
+        "duration": args.duration,
+        "nfiles": args.files,
+        "nflags": args.flags,
+    }
+    results_file = os.path.abspath(args.results)
+    timings = run(
+        config,
+        steps=args.steps,
+        repeat=args.repeat,
+        standin=args.standin,
+        root=args.root,
+    )
+    result = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "standin": args.standin,
+        "config": config,
+        "timings": timings,
+    }
+
+    results = []
+    if os.path.isfile(results_file):
+        with open(results_file) as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    compare(results, result)
+    with open(results_file, "a") as f:
+        f.write(json.dumps(result) + "\n")
@@ -0,0 +1,365 @@
+"""Lightweight stand-ins for the CASA modules used by casa_evn
+
+install() registers casatasks, casatools, casaplotms and casavlbitools
+modules doing the minimum file work each task is expected to do, so that
+the Python-side overhead of the pipeline can be benchmarked without CASA.
+"""
+import os
+import re
+import sys
+import types
+import shutil
+import numpy as np
+from astropy.io import fits as pyfits
+
+
+def _touch_table(path, nbytes=0):
+    os.makedirs(path, exist_ok=True)
+    with open(f"{path}/table.f0", "wb") as f:
+        f.write(b"\0" * nbytes)
+
+
+def _write_table(path, **columns):
+    os.makedirs(path, exist_ok=True)
+    np.savez(f"{path}/table.npz", **columns)
+
+
+def importfitsidi(fitsidifile, vis, **kwargs):
+    """Write the main table and the subtables used by casa_evn as npz"""
+    columns = {}
+    for idifile in fitsidifile:
+        with pyfits.open(idifile) as hdulist:
+            antennas = [str(a).strip() for a in hdulist["ANTENNA"].data["ANNAME"]]
+            sources = [str(f).strip() for f in hdulist["SOURCE"].data["SOURCE"]]
+            frequency = hdulist["FREQUENCY"].data
+            uv = hdulist["UV_DATA"]
+            nspw, nchan = uv.header["NO_BAND"], uv.header["NO_CHAN"]
+            nstokes = uv.header["NO_STKD"]
+            d = uv.data
+            flux = d["FLUX"].reshape(len(d), nspw, nchan, nstokes, 2)
+            data = (flux[..., 0] + 1j * flux[..., 1]).astype(np.complex64)
+            time = (d["DATE"] - 2400000.5 + d["TIME"]) * 86400.0
+            rep = lambda a: np.repeat(a, nspw)
+            chunk = {
+                "ANTENNA1": rep(d["BASELINE"] // 256 - 1),
+                "ANTENNA2": rep(d["BASELINE"] % 256 - 1),
+                "TIME": rep(time),
+                "FIELD_ID": rep(d["SOURCE"] - 1),
+                "DATA_DESC_ID": np.tile(np.arange(nspw), len(d)),
+                "DATA": data.reshape(len(d) * nspw, nchan, nstokes),
+            }
+        for k, v in chunk.items():
+            columns[k] = np.concatenate([columns[k], v]) if k in columns else v
+    field = columns["FIELD_ID"]
+    columns["SCAN_NUMBER"] = np.cumsum(np.concatenate([[1], field[1:] != field[:-1]]))
+    columns["FLAG"] = np.zeros(columns["DATA"].shape, dtype=bool)
+    columns["FLAG_ROW"] = np.zeros(len(columns["TIME"]), dtype=bool)
+    _write_table(vis, **columns)
+    _write_table(
+        f"{vis}/SPECTRAL_WINDOW",
+        NUM_CHAN=np.full(nspw, nchan),
+        REF_FREQUENCY=uv.header["REF_FREQ"] + frequency["BANDFREQ"][0],
+        TOTAL_BANDWIDTH=frequency["TOTAL_BANDWIDTH"][0],
+    )
+    _write_table(f"{vis}/DATA_DESCRIPTION", SPECTRAL_WINDOW_ID=np.arange(nspw))
+    _write_table(f"{vis}/ANTENNA", NAME=np.array(antennas))
+    _write_table(f"{vis}/FIELD", NAME=np.array(sources))
+
+
+class table:
+    """Subset of casatools.table over the npz tables written above
+
+    Array columns are stored row-major and returned in CASA order
+    (ncorr, nchan, nrow).
+    """
+
+    def __init__(self, _columns=None, _rows=None, _root=None):
+        self._columns, self._rows, self._root = _columns, _rows, _root
+
+    def open(self, path, nomodify=True):
+        self._path = path
+        with np.load(f"{path}/table.npz") as f:
+            self._columns = {k: f[k] for k in f.files}
+        self._dirty = False
+        return True
+
+    def colnames(self):
+        return list(self._columns)
+
+    def nrows(self):
+        if self._rows is not None:
+            return len(self._rows)
+        return len(next(iter(self._columns.values())))
+
+    def _select(self, startrow, nrow):
+        rows = self._rows if self._rows is not None else np.arange(self.nrows())
+        return rows[startrow : startrow + nrow if nrow >= 0 else None]
+
+    def getcol(self, columnname, startrow=0, nrow=-1):
+        value = self._columns[columnname][self._select(startrow, nrow)]
+        return value.T if value.ndim > 1 else value
+
+    def putcol(self, columnname, value, startrow=0, nrow=-1):
+        value = np.asarray(value)
+        self._columns[columnname][self._select(startrow, nrow)] = (
+            value.T if value.ndim > 1 else value
+        )
+        (self._root or self)._dirty = True
+
+    def query(self, query):
+        # TaQL comparisons joined with && and ||, evaluated with numpy
+        rows = self._rows if self._rows is not None else np.arange(self.nrows())
+        c = {k: v[rows] for k, v in self._columns.items() if v.ndim == 1}
+        operand = lambda t: f"c['{t}']" if t in c else t
+        expr = re.sub(
+            r"(\w+)\s*(==|!=|<=|>=|<|>)\s*(\w+)",
+            lambda m: f"({operand(m[1])} {m[2]} {operand(m[3])})",
+            query,
+        )
+        expr = expr.replace("&&", "&").replace("||", "|")
+        selected = np.broadcast_to(eval(expr, {}, {"c": c}), rows.shape)
+        return table(self._columns, rows[selected], self._root or self)
+
+    def close(self):
+        if self._root is None and self._dirty:
+            np.savez(f"{self._path}/table.npz", **self._columns)
+
+
+def flagdata(vis, mode="manual", inpfile=None, flagbackup=False, **kwargs):
+    if flagbackup:
+        flagmanager(vis, mode="save", versionname="flagdata_1")
+    if mode == "list" and inpfile is not None:
+        with open(inpfile) as f:
+            sum(1 for line in f if line.strip())
+
+
+def flagmanager(vis, mode="list", versionname=None, comment="", **kwargs):
+    listfile = f"{vis}.flagversions/FLAG_VERSION_LIST"
+    versions = []
+    if os.path.isfile(listfile):
+        with open(listfile) as f:
+            versions = [line.rstrip("\n") for line in f if line.strip()]
+    if mode == "save":
+        _touch_table(f"{vis}.flagversions/flags.{versionname}")
+        versions.append(f"{versionname} : {comment}")
+    elif mode == "delete":
+        shutil.rmtree(f"{vis}.flagversions/flags.{versionname}", ignore_errors=True)
+        versions = [v for v in versions if v.split(" : ")[0] != versionname]
+    if mode in ("save", "delete"):
+        with open(listfile, "w") as f:
+            f.writelines(f"{v}\n" for v in versions)
+
+
+def gencal(vis, caltable, caltype, **kwargs):
+    _touch_table(caltable)
+
+
+def applycal(vis, gaintable=(), **kwargs):
+    with np.load(f"{vis}/table.npz") as f:
+        columns = {k: f[k] for k in f.files}
+    columns["CORRECTED_DATA"] = columns["DATA"]
+    np.savez(f"{vis}/table.npz", **columns)
+
+
+def partition(vis, outputvis, **kwargs):
+    shutil.copytree(vis, outputvis)
+
+
+def mstransform(vis, outputvis, **kwargs):
+    shutil.copytree(vis, outputvis)
+
+
+def concat(vis, concatvis, **kwargs):
+    tables = []
+    for path in [concatvis] + list(vis):
+        with np.load(f"{path}/table.npz") as f:
+            tables.append({k: f[k] for k in f.files})
+    columns = set.intersection(*(set(t) for t in tables))
+    _write_table(concatvis, **{k: np.concatenate([t[k] for t in tables]) for k in columns})
+
+
+def fringefit(vis, caltable, minsnr=3.0, **kwargs):
+    """Solutions with random delays and rates, more of them failing at high minsnr"""
+    with np.load(f"{vis}/ANTENNA/table.npz") as f:
+        nant = len(f["NAME"])
+    with np.load(f"{vis}/DATA_DESCRIPTION/table.npz") as f:
+        nspw = len(f["SPECTRAL_WINDOW_ID"])
+    rng = np.random.default_rng(int(float(minsnr)))
+    antenna = np.repeat(np.arange(nant), nspw)
+    fparam = rng.normal(0, 1, (len(antenna), 1, 8)).astype(np.float32)
+    fparam[..., 2::4] *= 1e-12
+    flag = rng.uniform(size=fparam.shape) < float(minsnr) / 100
+    _write_table(caltable, ANTENNA1=antenna, FPARAM=fparam, FLAG=flag)
+
+
+def bandpass(vis, caltable, **kwargs):
+    _touch_table(caltable)
+
+
+def split(vis, outputvis, field="", datacolumn="corrected", **kwargs):
+    shutil.copytree(vis, outputvis)
+    with np.load(f"{vis}/FIELD/table.npz") as f:
+        fid = list(f["NAME"]).index(field)
+    with np.load(f"{vis}/table.npz") as f:
+        columns = {k: f[k] for k in f.files}
+    rows = columns["FIELD_ID"] == fid
+    columns = {k: v[rows] for k, v in columns.items()}
+    if "CORRECTED_DATA" in columns:
+        columns["DATA"] = columns.pop("CORRECTED_DATA")
+    _write_table(outputvis, **columns)
+
+
+def exportuvfits(vis, fitsfile, **kwargs):
+    with np.load(f"{vis}/table.npz") as f:
+        nbytes = f["DATA"].nbytes
+    with open(fitsfile, "wb") as f:
+        f.write(b"\0" * nbytes)
+
+
+def listobs(vis, listfile=None, **kwargs):
+    if listfile is not None:
+        with open(listfile, "w") as f:
+            f.write(f"listobs of {vis}\n")
+
+
+def plotms(**kwargs):
+    pass
+
+
+class msmetadata:
+    """Subset of casatools.msmetadata over the npz tables written above"""
+
+    def open(self, vis):
+        self._vis = vis
+        load = lambda sub: dict(np.load(f"{vis}/{sub}/table.npz"))
+        self._main = dict(np.load(f"{vis}/table.npz"))
+        self._spw = load("SPECTRAL_WINDOW")
+        self._dd = load("DATA_DESCRIPTION")
+        self._antenna = load("ANTENNA")
+        self._field = load("FIELD")
+        return True
+
+    def done(self):
+        self._main = None
+
+    def nrows(self):
+        return len(self._main["TIME"])
+
+    def antennanames(self):
+        return list(self._antenna["NAME"])
+
+    def nspw(self):
+        return len(self._spw["NUM_CHAN"])
+
+    def nchan(self, spw):
+        return int(self._spw["NUM_CHAN"][spw])
+
+    def meanfreq(self, spw):
+        return float(self._spw["REF_FREQUENCY"][spw])
+
+    def bandwidths(self, spw):
+        return float(self._spw["TOTAL_BANDWIDTH"][spw])
+
+    def datadescids(self):
+        return list(range(len(self._dd["SPECTRAL_WINDOW_ID"])))
+
+    def spwfordatadesc(self, ddid):
+        return int(self._dd["SPECTRAL_WINDOW_ID"][ddid])
+
+    def fieldnames(self):
+        return list(self._field["NAME"])
+
+    def scannumbers(self):
+        return np.unique(self._main["SCAN_NUMBER"])
+
+    def _scan(self, scan, column):
+        return np.unique(self._main[column][self._main["SCAN_NUMBER"] == scan])
+
+    def timesforscan(self, scan):
+        return self._scan(scan, "TIME")
+
+    def fieldsforscan(self, scan):
+        return self._scan(scan, "FIELD_ID")
+
+    def spwsforscan(self, scan):
+        dd = self._scan(scan, "DATA_DESC_ID")
+        return np.unique(self._dd["SPECTRAL_WINDOW_ID"][dd])
+
+    def antennasforscan(self, scan):
+        a1, a2 = self._scan(scan, "ANTENNA1"), self._scan(scan, "ANTENNA2")
+        return np.union1d(a1, a2)
+
+    def intentsforscan(self, scan):
+        return []
+
+
+def append_tsys(antabfile, idifiles):
+    with open(antabfile) as f:
+        f.read()
+    for idifile in idifiles:
+        hdu = pyfits.BinTableHDU.from_columns(
+            [pyfits.Column("TIME", "1D", array=[0.0])], name="SYSTEM_TEMPERATURE"
+        )
+        pyfits.append(idifile, hdu.data, hdu.header)
+
+
+def append_gc(antabfile, idifile):
+    hdu = pyfits.BinTableHDU.from_columns(
+        [pyfits.Column("ANTENNA_NO", "1J", array=[1])], name="GAIN_CURVE"
+    )
+    pyfits.append(idifile, hdu.data, hdu.header)
+
+
+def convert_flags(infile, idifiles, outfile=None, **kwargs):
+    with open(infile) as fin, open(outfile, "w") as fout:
+        for line in fin:
+            if line.strip():
+                fout.write("antenna='0' timerange='' reason='synthetic'\n")
+
+
+def install():
+    """Register the stand-in modules in sys.modules
+
+    The spawned worker processes of the pipeline (see
+    instrument.process_pool) run install too.
+    """
+
+    def module(name, **attrs):
+        m = types.ModuleType(name)
+        m.__dict__.update(attrs)
+        return m
+
+    casatasks = module(
+        "casatasks",
+        importfitsidi=importfitsidi,
+        bandpass=bandpass,
+        flagdata=flagdata,
+        flagmanager=flagmanager,
+        fringefit=fringefit,
+        gencal=gencal,
+        applycal=applycal,
+        concat=concat,
+        exportuvfits=exportuvfits,
+        listobs=listobs,
+        mstransform=mstransform,
+        partition=partition,
+        split=split,
+    )
+    fitsidi = module(
+        "casavlbitools.fitsidi",
+        append_tsys=append_tsys,
+        append_gc=append_gc,
+        convert_flags=convert_flags,
+    )
+    sys.modules.update(
+        {
+            "casatasks": casatasks,
+            "casatools": module("casatools", msmetadata=msmetadata, table=table),
+            "casaplotms": module("casaplotms", plotms=plotms),
+            "casavlbitools": module("casavlbitools", fitsidi=fitsidi),
+            "casavlbitools.fitsidi": fitsidi,
+        }
+    )
+    from casa_evn import instrument
+
+    instrument.worker_init = install
@@ -0,0 +1,258 @@
+import os
+import numpy as np
+from astropy.io import fits as pyfits
+
+evn_antennas = [
+    "EF", "WB", "JB", "ON", "MC", "NT", "TR", "YS",
+    "SV", "BD", "ZC", "HH", "T6", "UR", "IR", "O8",
+]
+
+
+def _common_header(header, obscode, nspw, nchan, ref_freq, chan_bw):
+    header["TABREV"] = 1
+    header["OBSCODE"] = obscode
+    header["NO_STKD"] = 2
+    header["STK_1"] = -1
+    header["NO_BAND"] = nspw
+    header["NO_CHAN"] = nchan
+    header["REF_FREQ"] = ref_freq
+    header["CHAN_BW"] = chan_bw
+    header["REF_PIXL"] = 1.0
+    header["RDATE"] = "2020-04-09"
+    return header
+
+
+def _table(extname, columns, obscode, nspw, nchan, ref_freq, chan_bw):
+    hdu = pyfits.BinTableHDU.from_columns(columns)
+    hdu.header["EXTNAME"] = extname
+    _common_header(hdu.header, obscode, nspw, nchan, ref_freq, chan_bw)
+    return hdu
+
+
+def make_idi(
+    idifile,
+    obscode,
+    antennas,
+    nspw=4,
+    nchan=32,
+    inttime=2.0,
+    start=0.5,
+    duration=600.0,
+    ref_freq=4.926e9,
+    chan_bw=500e3,
+    seed=0,
+):
+    """Write a minimal FITS-IDI file with random visibilities
+
+    Parameters
+    ----------
+        idifile: str
+        obscode: str
+        antennas: list
+            antenna names
+        nspw, nchan: int
+            number of spectral windows and channels per window
+        inttime: float
+            integration time [s]
+        start: float
+            start time [fraction of day]
+        duration: float
+            duration [s]
+    """
+    rng = np.random.default_rng(seed)
+    nant = len(antennas)
+    nstokes = 2
+    table = lambda extname, columns: _table(
+        extname, columns, obscode, nspw, nchan, ref_freq, chan_bw
+    )
+
+    array_geometry = table(
+        "ARRAY_GEOMETRY",
+        [
+            pyfits.Column("ANNAME", "8A", array=antennas),
+            pyfits.Column("STABXYZ", "3D", array=rng.normal(0, 6e6, (nant, 3))),
+            pyfits.Column("NOSTA", "1J", array=np.arange(1, nant + 1)),
+            pyfits.Column("MNTSTA", "1J", array=np.zeros(nant)),
+        ],
+    )
+    antenna = table(
+        "ANTENNA",
+        [
+            pyfits.Column("TIME", "1D", array=np.zeros(nant)),
+            pyfits.Column("ANNAME", "8A", array=antennas),
+            pyfits.Column("ANTENNA_NO", "1J", array=np.arange(1, nant + 1)),
+            pyfits.Column("ARRAY", "1J", array=np.ones(nant)),
+            pyfits.Column("FREQID", "1J", array=np.ones(nant)),
+            pyfits.Column("POLTYA", "1A", array=["R"] * nant),
+            pyfits.Column("POLTYB", "1A", array=["L"] * nant),
+        ],
+    )
+    frequency = table(
+        "FREQUENCY",
+        [
+            pyfits.Column("FREQID", "1J", array=[1]),
+            pyfits.Column(
+                "BANDFREQ", f"{nspw}D", array=[np.arange(nspw) * nchan * chan_bw]
+            ),
+            pyfits.Column("CH_WIDTH", f"{nspw}E", array=[np.full(nspw, chan_bw)]),
+            pyfits.Column(
+                "TOTAL_BANDWIDTH", f"{nspw}E", array=[np.full(nspw, nchan * chan_bw)]
+            ),
+            pyfits.Column("SIDEBAND", f"{nspw}J", array=[np.ones(nspw)]),
+        ],
+    )
+    source = table(
+        "SOURCE",
+        [
+            pyfits.Column("SOURCE_ID", "1J", array=[1, 2]),
+            pyfits.Column("SOURCE", "16A", array=["FRINGEFINDER", "TARGET"]),
+            pyfits.Column("RAEPO", "1D", array=[83.63, 84.0]),
+            pyfits.Column("DECEPO", "1D", array=[22.01, 22.5]),
+        ],
+    )
+
+    baselines = [
+        256 * (a1 + 1) + (a2 + 1) for a1 in range(nant) for a2 in range(a1, nant)
+    ]
+    nint = max(1, int(duration / inttime))
+    nrows = nint * len(baselines)
+    times = start + (np.arange(nint) * inttime / 86400.0)
+    # Two scans: fringe finder in the first third, target afterwards
+    sources = np.where(np.arange(nint) < nint // 3, 1, 2)
+    flux = rng.normal(0, 1, (nrows, nspw, nchan, nstokes, 2))
+    # Fringe finder signal: unit amplitude with a per-antenna delay
+    delays = rng.uniform(-50e-9, 50e-9, nant)
+    a1 = np.array(baselines) // 256 - 1
+    a2 = np.array(baselines) % 256 - 1
+    bl = np.tile(np.arange(len(baselines)), nint)
+    on_source = np.repeat(sources == 1, len(baselines)) & (a1 != a2)[bl]
+    delay = (delays[a1] - delays[a2])[bl]
+    phase = 2 * np.pi * np.outer(delay, np.arange(nchan) * chan_bw)
+    signal = np.where(on_source[:, None], np.exp(1j * phase), 0)[:, None, :, None]
+    flux[..., 0] += signal.real
+    flux[..., 1] += signal.imag
+    flux = flux.reshape(nrows, -1).astype(np.float32)
+    uv_data = table(
+        "UV_DATA",
+        [
+            pyfits.Column("UU", "1E", array=rng.normal(0, 1e-3, nrows)),
+            pyfits.Column("VV", "1E", array=rng.normal(0, 1e-3, nrows)),
+            pyfits.Column("WW", "1E", array=rng.normal(0, 1e-4, nrows)),
+            pyfits.Column("DATE", "1D", array=np.full(nrows, 2458948.5)),
+            pyfits.Column("TIME", "1D", array=np.repeat(times, len(baselines))),
+            pyfits.Column("BASELINE", "1J", array=np.tile(baselines, nint)),
+            pyfits.Column("SOURCE", "1J", array=np.repeat(sources, len(baselines))),
+            pyfits.Column("FREQID", "1J", array=np.ones(nrows)),
+            pyfits.Column("INTTIM", "1E", array=np.full(nrows, inttime)),
+            pyfits.Column("FLUX", f"{flux.shape[1]}E", array=flux),
+        ],
+    )
+    header = uv_data.header
+    header["NMATRIX"] = 1
+    axes = [
+        ("COMPLEX", 2),
+        ("STOKES", nstokes),
+        ("FREQ", nchan),
+        ("BAND", nspw),
+        ("RA", 1),
+        ("DEC", 1),
+    ]
+    for i, (ctype, maxis) in enumerate(axes, start=1):
+        header[f"MAXIS{i}"] = maxis
+        header[f"CTYPE{i}"] = ctype
+    header["CRVAL2"], header["CDELT2"] = -1.0, -1.0
+    header["CRVAL3"], header["CDELT3"], header["CRPIX3"] = ref_freq, chan_bw, 1.0
+
+    primary = pyfits.PrimaryHDU()
+    primary.header["CORRELAT"] = "SFXC"
+    pyfits.HDUList(
+        [primary, array_geometry, antenna, frequency, source, uv_data]
+    ).writeto(idifile, overwrite=True)
+    return nrows
+
+
+def make_antab(antabfile, antennas, nspw=4, start=0.5, duration=600.0, doy=100):
+    """Write an ANTAB file with one TSYS record per minute and antenna"""
+    index = ",".join(f"'R{i}','L{i}'" for i in range(1, nspw + 1))
+    minutes = np.arange(start * 1440, start * 1440 + duration / 60.0 + 1)
+    with open(antabfile, "w") as f:
+        for ant in antennas:
+            f.write(f"GAIN {ant} ELEV DPFU=0.14,0.14 FREQ=4500,5500\n")
+            f.write("POLY=1.0 /\n")
+            f.write(f"TSYS {ant} FT=1.0 TIMEOFF=0\nINDEX={index}\n/\n")
+            for m in minutes:
+                tsys = " ".join(["45.0"] * (2 * nspw))
+                f.write(f"{doy} {int(m // 60):02d}:{m % 60:05.2f} {tsys}\n")
+            f.write("/\n")
+
+
+def make_uvflg(
+    uvflgfile, antennas, start=0.5, duration=600.0, nflags=200, seed=0
+):
+    """Write an AIPS UVFLG file with random, overlapping per-antenna flags
+
+    Days in TIMERANG count from the reference date of the IDI files.
+    """
+    rng = np.random.default_rng(seed)
+    t0 = start * 86400
+    fmt = lambda t: (
+        f"0,{int(t // 3600):02d},{int(t % 3600 // 60):02d},{int(t % 60):02d}"
+    )
+    with open(uvflgfile, "w") as f:
+        for _ in range(nflags):
+            ant = rng.choice(antennas)
+            begin = t0 + rng.uniform(0, duration)
+            end = begin + rng.uniform(1, duration / 20)
+            f.write(
+                f"ant_name='{ant}' timerang={fmt(begin)}, {fmt(end)} "
+                f"bif=1 eif=0 bchan=1 echan=0 reason='synthetic' /\n"
+            )
+
+
+def make_experiment(
+    root,
+    experiment="bench",
+    nant=6,
+    nspw=4,
+    nchan=32,
+    inttime=2.0,
+    duration=600.0,
+    nfiles=2,
+    nflags=200,
+):
+    """Lay out a synthetic experiment as expected by calibration.py
+
+    {root}/fits/{experiment}_1_1.IDI{n}, {root}/pipeline_calibration/
+    {experiment}.antab and .uvflg, and {root}/run/EVN.gc
+
+    Returns
+    -------
+        workdir: str
+            directory to run the pipeline from
+    """
+    antennas = evn_antennas[:nant]
+    fitsdir = f"{root}/fits"
+    calibdir = f"{root}/pipeline_calibration"
+    workdir = f"{root}/run"
+    for d in (fitsdir, calibdir, workdir):
+        os.makedirs(d, exist_ok=True)
+
+    start = 0.5
+    chunk = duration / nfiles
+    for n in range(nfiles):
+        make_idi(
+            f"{fitsdir}/{experiment}_1_1.IDI{n + 1}",
+            experiment.upper(),
+            antennas,
+            nspw=nspw,
+            nchan=nchan,
+            inttime=inttime,
+            start=start + n * chunk / 86400.0,
+            duration=chunk,
+            seed=n,
+        )
+    make_antab(f"{calibdir}/{experiment}.antab", antennas, nspw, start, duration)
+    make_uvflg(f"{calibdir}/{experiment}.uvflg", antennas, start, duration, nflags)
+    with open(f"{workdir}/EVN.gc", "w") as f:
+        f.write("! synthetic gain curves\n")
+    return workdir
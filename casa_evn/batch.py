@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import traceback
+
+
+def read_manifest(manifest):
+    """Experiment codes of a manifest, one per line
+
+    A line may give the experiment directory after the code; blank lines
+    and lines starting with # are ignored.
+
+    Returns
+    -------
+        list: (experiment, experiment directory or None)
+    """
+    experiments = []
+    with open(manifest) as f:
+        for line in f:
+            fields = line.split("#")[0].split()
+            if fields:
+                base = fields[1] if len(fields) > 1 else None
+                experiments.append((fields[0], base))
+    return experiments
+
+
+def _run_experiment(experiment, base, work, io_slots, run_kwargs):
+    """Run the pipeline of one experiment in its working directory
+
+    Runs in a worker process; the output goes to {experiment}.log in the
+    working directory.
+    """
+    workpath = f"{base}/{work}"
+    os.makedirs(workpath, exist_ok=True)
+    os.chdir(workpath)
+
+    start = time.perf_counter()
+    status, error = "ok", None
+    with open(f"{workpath}/{experiment}.log", "a") as log:
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = log
+        try:
+            from . import calibration
+
+            calibration.set_dirs(base, work)
+            state = calibration.run_steps(
+                experiment, io_slots=io_slots, **run_kwargs
+            )
+        except Exception as e:
+            status, error, state = "failed", f"{type(e).__name__}: {e}", {}
+            traceback.print_exc()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    return {
+        "experiment": experiment,
+        "workdir": workpath,
+        "status": status,
+        "error": error,
+        "wall_s": round(time.perf_counter() - start, 1),
+        "steps": {name: record.get("elapsed_s") for name, record in state.items()},
+    }
+
+
+def run_batch(
+    experiments,
+    data=None,
+    work="run",
+    max_workers=2,
+    io_slots=1,
+    report=None,
+    step_workers=1,
+    **run_kwargs,
+):
+    """Run the pipeline for many experiments in a pool of worker processes
+
+    Parameters
+    ----------
+        experiments: list
+            experiment codes, or (experiment, experiment directory) pairs
+        data: str
+            directory holding one directory per experiment, used when the
+            experiment directory is not given (default: current directory)
+        work: str
+            name of the working directory in each experiment directory
+            (default: 'run')
+        max_workers: int
+            Number of experiments processed at once (default: 2)
+        io_slots: int
+            Number of I/O-heavy steps (calibration.io_heavy_steps) allowed
+            to run at once over all experiments (default: 1)
+        report: str
+            JSON file the consolidated report is written to (default: None)
+        step_workers: int
+            Number of worker processes of the per-file steps of each
+            experiment, the max_workers of calibration.run_steps
+            (default: 1)
+        run_kwargs:
+            passed on to calibration.run_steps
+
+    Returns
+    -------
+        list: one status/timing dict per experiment
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    data = os.path.abspath(data or ".")
+    jobs = [e if isinstance(e, (tuple, list)) else (e, None) for e in experiments]
+    jobs = [(e, os.path.abspath(base or f"{data}/{e}")) for e, base in jobs]
+    run_kwargs = {**run_kwargs, "max_workers": step_workers}
+
+    # Each experiment gets its own process: CASA keeps global state
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Manager() as manager:
+        slots = manager.Semaphore(io_slots)
+        # max_tasks_per_child only exists from Python 3.11; before, the
+        # spawned workers are reused and may run several experiments in turn
+        fresh = {"max_tasks_per_child": 1} if sys.version_info >= (3, 11) else {}
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=context, **fresh
+        ) as pool:
+            futures = {
+                pool.submit(_run_experiment, e, base, work, slots, run_kwargs): e
+                for e, base in jobs
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                mark = "✅" if result["status"] == "ok" else "🛑"
+                print(
+                    f"{mark} {result['experiment']}: {result['status']} "
+                    f"in {result['wall_s']} s"
+                )
+                results.append(result)
+
+    results.sort(key=lambda r: [e for e, _ in jobs].index(r["experiment"]))
+    summary(results)
+    if report is not None:
+        with open(report, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def summary(results):
+    """Print a status/timing table of a batch"""
+    steps = []
+    for r in results:
+        steps += [s for s in r["steps"] if s not in steps]
+    cell = lambda t: f"{t:>10.1f}" if t is not None else f"{'-':>10}"
+
+    header = " ".join(f"{s[:10]:>10}" for s in steps)
+    print(f"{'experiment':<14}{'status':<8}{'wall[s]':>9}  {header}")
+    for r in results:
+        cells = " ".join(cell(r["steps"].get(s)) for s in steps)
+        print(f"{r['experiment']:<14}{r['status']:<8}{r['wall_s']:>9.1f}  {cells}")
+    for r in results:
+        if r["error"]:
+            log = f"{r['workdir']}/{r['experiment']}.log"
+            print(f"🛑 {r['experiment']}: {r['error']} (see {log})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibrate many experiments")
+    parser.add_argument(
+        "experiment", nargs="*", type=str, help="project ids (in lower case)"
+    )
+    parser.add_argument(
+        "-m", "--manifest", type=str, help="file listing one experiment per line"
+    )
+    parser.add_argument(
+        "-d",
+        "--data",
+        type=str,
+        default=".",
+        help="directory holding one directory per experiment",
+    )
+    parser.add_argument(
+        "-w", "--work", type=str, default="run", help="working directory name"
+    )
+    parser.add_argument(
+        "-n", "--workers", type=int, default=2, help="experiments processed at once"
+    )
+    parser.add_argument(
+        "-j",
+        "--step-workers",
+        type=int,
+        default=1,
+        help="worker processes of the per-file steps of each experiment",
+    )
+    parser.add_argument(
+        "--io-slots", type=int, default=1, help="I/O-heavy steps running at once"
+    )
+    parser.add_argument("--report", type=str, help="JSON report file")
+    parser.add_argument("-s", "--steps", nargs="+", type=str, default=None)
+    parser.add_argument("-r", "--refant", type=str, default="EF")
+    parser.add_argument("-p", "--partition", choices=["scan", "spw", "auto"])
+    parser.add_argument(
+        "--scratch", type=str, help="local directory to stage the data in"
+    )
+    args = parser.parse_args()
+
+    experiments = list(args.experiment)
+    if args.manifest:
+        experiments += read_manifest(args.manifest)
+    run_kwargs = {
+        "refant": args.refant,
+        "partition": args.partition,
+        "scratch": args.scratch,
+    }
+    if args.steps:
+        run_kwargs["steps"] = args.steps
+    run_batch(
+        experiments,
+        data=args.data,
+        work=args.work,
+        max_workers=args.workers,
+        io_slots=args.io_slots,
+        report=args.report,
+        step_workers=args.step_workers,
+        **run_kwargs,
+    )
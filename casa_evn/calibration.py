@@ -1,29 +1,76 @@
 import os
+import glob
 import numpy as np
 from . import funcs as _f
+from . import pipeline as _p
+from . import instrument as _i
+from . import planner as _pl
+from . import scratch as _scratch
 
 basedir, workdir = os.path.split(os.path.abspath("."))
 fitsdir = "fits"
 calibdir = "pipeline_calibration"
 
 set_vis = (
-    lambda experiment, basedir=basedir, workdir=workdir: f"{basedir}/{workdir}/{experiment}.ms"
+    lambda experiment, base=None, work=None: f"{base or basedir}/{work or workdir}/{experiment}.ms"
 )
-get_steps = lambda: [
-    "unzip_gz",
+set_mms = lambda vis: f"{os.path.splitext(vis)[0]}.mms"
+
+
+def get_gcfile():
+    """EVN.gc of the working directory, else of calibdir (init_casa.sh -i)"""
+    gcfile = f"{basedir}/{workdir}/EVN.gc"
+    if not os.path.isfile(gcfile) and os.path.isfile(f"{basedir}/{calibdir}/EVN.gc"):
+        return f"{basedir}/{calibdir}/EVN.gc"
+    return gcfile
+
+
+# Steps reading or writing the bulk of the raw data
+io_heavy_steps = [
     "check_tsys_gaincurve",
-    "gen_list_of_scans",
-    "convert_flag",
     "import_fits_idi",
+    "partition_ms",
+    "merge_mms",
+]
+# Steps run on the multi-MS when the MS is partitioned
+mms_steps = [
     "flag_data",
     "gen_cal",
     "apply_cal",
     "flag_autocorrelation",
     "flagquack_intervals",
+    "fringe_sbd",
+    "fringe_mbd",
+    "bandpass",
+    "apply_final",
+    "diagnostics",
+    "export_products",
+]
+get_steps = lambda partition=False, merge=True: [
+    "unzip_gz",
+    "validate",
+    "check_tsys_gaincurve",
+    "convert_flag",
+    "import_fits_idi",
+    "gen_list_of_scans",
+    *(["partition_ms"] if partition else []),
+    *mms_steps,
+    *(["merge_mms"] if partition and merge else []),
+]
+# Entries of the working directory staged on scratch: MS, multi-MS, their
+# flag versions and metadata, calibration tables and their store, and the
+# averaged visibilities of the diagnostic plots
+staged_patterns = lambda experiment: [
+    f"{experiment}.ms*",
+    f"{experiment}.mms*",
+    *(f"{experiment}.{t}" for t in ("gcal", "tsys", "sbd", "mbd", "bpass")),
+    "caltables",
+    "avgcache",
 ]
 dict_as_list = lambda _dict: (_dict[v] for v in _dict.keys())
 steps_desc = {
     "unzip_gz": "Unzipping gz files",
+    "validate": "Validating the inputs",
     "check_tsys_gaincurve": "Checking TSYS and gain curve exist",
     "gen_list_of_scans": "Generating list of scans",
     "convert_flag": "coverting flag",
@@ -31,12 +78,29 @@ steps_desc = {
     "flag_data": "Flagging data",
     "gen_cal": "Generating calibration",
     "apply_cal": "Applying calibration",
-    "flag_autocorrelation": "Flagging autocorrelation",
-    "flagquack_intervals": "Flagging quack intervals",
+    "flag_autocorrelation": "Flagging autocorrelation, edges and quack intervals",
+    "flagquack_intervals": "Saving pre-calibration flags",
+    "fringe_sbd": "Fringe fitting the single-band delay",
+    "fringe_mbd": "Fringe fitting the multi-band delay and rate",
+    "bandpass": "Solving the bandpass",
+    "apply_final": "Applying the full calibration",
+    "diagnostics": "Rendering diagnostic plots",
+    "export_products": "Exporting per-source MS and UVFITS products",
+    "partition_ms": "Partitioning the MS into a multi-MS",
+    "merge_mms": "Merging the multi-MS back into the MS",
 }
 
 
-def get_variables(experiment, refant="EF", return_as_dict=False):
+def set_dirs(base, work):
+    """Set the experiment directory and the working directory name in it
+
+    By default they are taken from the current directory, {base}/{work}.
+    """
+    global basedir, workdir
+    basedir, workdir = base, work
+
+
+def get_variables(experiment, refant="EF", return_as_dict=False, datadir=None):
     """Get values for common variables
 
     Parameters
@@ -44,18 +108,23 @@ def get_variables(experiment, refant="EF", return_as_dict=False):
         experiment: str
             experiment code
         refant: str
-            Reference antenna (default: 'EF')
+            Reference antenna (default: 'EF'), or 'auto' to rank the
+            antennas from the data once the MS exists (see resolve_refant)
         return_as_dict: bool
             Returns variables as a list (default)
             or as a dict (to know what's what)
+        datadir: str
+            Directory of the MS and calibration tables (default: None, the
+            working directory)
     Returns
     -------
         dict: vis, refant, gcaltab, tsystab, sbdtab, mbdtab, bpasstab, idifiles
     """
     refant = refant
-    vis = set_vis(experiment)
+    base, work = os.path.split(datadir) if datadir else (basedir, workdir)
+    vis = set_vis(experiment, base, work)
     gcaltab, tsystab, sbdtab, mbdtab, bpasstab = _f.set_working_vars(
-        basedir, workdir, experiment
+        base, work, experiment
     )
     idifiles = _f.get_idifiles(basedir, fitsdir, experiment)
 
@@ -76,75 +145,435 @@ def get_variables(experiment, refant="EF", return_as_dict=False):
         return dict_as_list(d)
 
 
-def run_steps(experiment, steps=get_steps(), verbose=True):
-    """Generate strings matching function calls
+def _with(context, func):
+    with context:
+        return func()
+
+
+def resolve_refant(vis, refant):
+    """Reference antenna list, ranked from the data if refant is 'auto'"""
+    return _f.select_refant(vis) if refant == "auto" else refant
+
+
+def gain_chain(vis, experiment, upto="bpass"):
+    """Calibration tables applied on the fly by a step, see funcs.gain_chain
+
+    Tables are applied in the order gcal, tsys, sbd, mbd, bpass; the chain
+    stops before upto, or includes all tables if upto is 'all'.
+    """
+    kinds = ["gcal", "tsys", "sbd", "mbd", "bpass"]
+    datadir = os.path.split(os.path.dirname(vis))
+    tables = dict(zip(kinds, _f.set_working_vars(*datadir, experiment)))
+    kinds = kinds if upto == "all" else kinds[: kinds.index(upto)]
+    return _f.gain_chain(vis, [(kind, tables[kind]) for kind in kinds])
+
+
+def get_step_io(experiment, vis, tsystab, gcaltab, idifiles, mms=None):
+    """Inputs and outputs of each step
 
     Parameters
     ----------
-        experiment, steps
+        experiment, vis, tsystab, gcaltab, idifiles
+        mms: str
+            multi-MS the mms_steps work on, if the MS is partitioned
 
+    Returns
+    -------
+        dict: step name -> (inputs, outputs)
     """
-    idifiles = _f.get_idifiles(basedir, fitsdir, experiment)
-    is_in_steps = lambda step, steps=steps: (step in steps)
-    vis, refant, gcaltab, tsystab, sbdtab, mbdtab, bpasstab, idifiles = get_variables(
-        experiment
+    calib = f"{basedir}/{calibdir}/{experiment}"
+    work = f"{basedir}/{workdir}"
+    antabfile = f"{calib}.antab"
+    uvflgfile = f"{calib}.uvflg"
+    listobsfile = f"{calib}.listobs"
+    flagfile = f"{work}/{experiment}.flag"
+    gcfile = get_gcfile()
+    gzfiles = glob.glob(f"{basedir}/{calibdir}/*.gz")
+    data = mms or vis
+    datadir = os.path.split(os.path.dirname(vis))
+    _, _, sbdtab, mbdtab, bpasstab = _f.set_working_vars(*datadir, experiment)
+    scanfile = f"{work}/{experiment}.fringe_scan.json"
+    gains = [gcaltab, tsystab]
+
+    return {
+        "unzip_gz": (gzfiles, [f[: -len(".gz")] for f in gzfiles]),
+        "validate": (
+            [antabfile, uvflgfile, gcfile] + idifiles,
+            [f"{work}/{experiment}.validation.json"],
+        ),
+        "check_tsys_gaincurve": ([antabfile] + idifiles, idifiles),
+        "convert_flag": ([uvflgfile] + idifiles, [flagfile]),
+        "import_fits_idi": (idifiles, [vis]),
+        "gen_list_of_scans": ([vis], [listobsfile]),
+        "partition_ms": ([vis], [data]),
+        "flag_data": ([data, flagfile], [data]),
+        "gen_cal": ([data, gcfile], [tsystab, gcaltab]),
+        "apply_cal": ([data, tsystab, gcaltab], [data]),
+        "flag_autocorrelation": ([data], [data]),
+        "flagquack_intervals": ([data], [data]),
+        "fringe_sbd": ([data] + gains, [sbdtab, scanfile]),
+        "fringe_mbd": ([data, scanfile] + gains + [sbdtab], [mbdtab]),
+        "bandpass": ([data, scanfile] + gains + [sbdtab, mbdtab], [bpasstab]),
+        "apply_final": ([data] + gains + [sbdtab, mbdtab, bpasstab], [data]),
+        "diagnostics": ([data, scanfile], [f"{work}/diagnostics/index.html"]),
+        "export_products": ([data, scanfile], [f"{work}/products/products.json"]),
+        "merge_mms": ([data], [vis]),
+    }
+
+
+def import_incremental(
+    experiment, vis, tsystab, gcaltab, idifiles, statefile, replay=True, aliases=None
+):
+    """Import new FITS-IDI files only, replaying the completed steps on them
+
+    flag_data, apply_cal (with calibration tables generated from the new
+    data) and flag_autocorrelation are applied to the new data before it is
+    appended to vis if they completed before; the calibration tables are
+    then generated again over the whole MS.
+
+    Parameters
+    ----------
+        experiment, vis, tsystab, gcaltab, idifiles
+        statefile: str
+            pipeline state, telling which steps completed
+        replay: bool
+            Replay the completed steps (default: True); not done for a
+            partitioned MS, whose multi-MS is made again from vis anyway
+        aliases: dict
+            see caltables.solve (default: None)
+
+    Returns
+    -------
+        list: steps reproduced on the new data
+    """
+
+    def recalibrate(ms):
+        _f.gen_cal(ms, f"{ms}.tsys", f"{ms}.gcal", gcfile=get_gcfile(), reuse=False)
+        _f.apply_cal(ms, f"{ms}.tsys", f"{ms}.gcal")
+
+    replays = {
+        "flag_data": lambda ms: _f.flag_data(basedir, workdir, experiment, ms),
+        "apply_cal": recalibrate,
+        "flag_autocorrelation": _f.flag_autocorrelation,
+    }
+    state = _p.load_state(statefile) if replay else {}
+    done = [s for s in get_steps() if s in state and (s in replays or s == "gen_cal")]
+    new = _f.import_fits_idi(
+        basedir,
+        fitsdir,
+        workdir,
+        experiment,
+        vis,
+        idifiles,
+        incremental=True,
+        replay=[replays[s] for s in done if s in replays],
     )
+    if not new:
+        return []
+    if "gen_cal" in done:
+        _f.gen_cal(vis, tsystab, gcaltab, gcfile=get_gcfile(), aliases=aliases)
+    return done
 
-    if is_in_steps("unzip_gz"):
-        if verbose:
-            print("Unzipping gz files")
-        _f.gunzip(basedir, calibdir)
 
-    if is_in_steps("check_tsys_gaincurve"):
-        if verbose:
-            print("Checking TSYS and gain curve")
-        _f.append_tsys_gaincurve(basedir, calibdir, experiment, idifiles)
+def run_steps(
+    experiment,
+    steps=get_steps(),
+    verbose=True,
+    max_workers=1,
+    force=False,
+    max_concurrency=1,
+    refant="EF",
+    io_slots=None,
+    partition=None,
+    merge=True,
+    incremental=False,
+    timebin="0s",
+    width=1,
+    calibrators=None,
+    dry_run=False,
+    cost_model=None,
+    scratch=None,
+    prune_flags=False,
+):
+    """Run the pipeline steps, resuming after the last completed one
 
-    if is_in_steps("convert_flag"):
-        if verbose:
-            print("Converting flag")
-        _f.convert_flag(basedir, calibdir, workdir, experiment, idifiles)
+    Completed steps are recorded in {experiment}.state.json in the working
+    directory; a step is skipped when it completed before and its inputs
+    have not changed since. Timing and resource usage of every step and
+    CASA task are appended to {experiment}.trace.jsonl and summarised at
+    the end.
 
-    if is_in_steps("gen_list_of_scans"):
-        if verbose:
-            print("Generating list of scans")
-        _f.gen_list_of_scans(basedir, calibdir, experiment, vis)
+    Parameters
+    ----------
+        experiment, steps
+        max_workers: int
+            Number of worker processes for per-file steps (default: 1)
+        force: bool
+            Rerun the selected steps even if up to date (default: False)
+        max_concurrency: int
+            Number of independent steps allowed to run at once (default: 1)
+        refant: str
+            Reference antenna(s), or 'auto' (default: 'EF')
+        io_slots: semaphore
+            Acquired around the io_heavy_steps, to limit how many of them
+            run at once across experiments (default: None)
+        partition: str
+            Partition the imported MS into {experiment}.mms along 'scan',
+            'spw' or 'auto', so that flagdata, gencal and applycal run on
+            the MPI servers under mpicasa (default: None, no partition)
+        merge: bool
+            Merge the multi-MS back into the MS at the end (default: True);
+            otherwise later steps keep working on the multi-MS
+        incremental: bool
+            Append FITS-IDI files not imported yet to the existing MS, and
+            replay on them the flagging and calibration steps already done
+            (default: False)
+        timebin, width: str, int
+            Time and channel averaging of the exported products (default:
+            '0s', 1, no averaging)
+        calibrators: list
+            Fields of the multi-band delay fringe fit, left out of the
+            products (default: None, the fields observed with calibration
+            intents only, or the fringe finder if the MS has no intents)
+        dry_run: bool
+            Only print the steps that would run and their paths, without
+            importing CASA (default: False); returns the plan, see
+            pipeline.plan, with the time and bytes written estimated for
+            each step (see planner.estimate)
+        cost_model: str
+            JSON cost model of the dry run, see planner.fit_model (default:
+            None, fitted on the previous runs of the experiment)
+        scratch: str
+            Fast local directory the MS and calibration tables are staged
+            in, as {scratch}/{experiment}, and copied back from at the end
+            (default: None, work in the working directory); only the files
+            that differ are copied either way
+        prune_flags: bool
+            Delete the intermediate flag versions at the end, see
+            funcs.prune_flag_versions (default: False)
 
-    if is_in_steps("import_fits_idi"):
-        if verbose:
-            print("Importing FITS-IDI files")
-        _f.import_fits_idi(basedir, fitsdir, workdir, experiment, vis, idifiles)
+    """
+    archive = f"{basedir}/{workdir}"
+    # The state records the working directory paths, which a dry run plans
+    # with; staging maps the scratch paths to them (see pipeline.logical_path)
+    scratch = None if dry_run else scratch
+    datadir = f"{scratch}/{experiment}" if scratch else archive
+    aliases = {datadir: archive} if scratch else None
+    disks = [datadir, archive] if scratch else [archive]
+    vis, refant, gcaltab, tsystab, sbdtab, mbdtab, bpasstab, idifiles = get_variables(
+        experiment, refant=refant, datadir=datadir
+    )
+    mms = set_mms(vis) if partition else None
+    data = mms or vis
+    order = get_steps(partition=bool(partition), merge=merge)
+    if partition and any(step in mms_steps for step in steps):
+        # The multi-MS must exist (and be merged back) around those steps
+        steps = [s for s in order if s in steps or s in ("partition_ms", "merge_mms")]
 
-    if is_in_steps("flag_data"):
-        if verbose:
-            print("Flagging data")
-        _f.flag_data(basedir, workdir, experiment, vis)
+    refants = {}
 
-    if is_in_steps("gen_cal"):
-        if verbose:
-            print("Generating calibration")
-        _f.gen_cal(vis, tsystab, gcaltab)
+    def get_refant():
+        # 'auto' ranks the antennas with a pass over the MS, once per run
+        if refant not in refants:
+            refants[refant] = resolve_refant(data, refant)
+        return refants[refant]
 
-    if is_in_steps("apply_cal"):
-        if verbose:
-            print("Applying calibration")
-        _f.apply_cal(vis, tsystab, gcaltab)
+    # The steps after fringe_sbd use the antennas it was solved with, also
+    # when resumed in a later run
+    sbd_refant = lambda: _f.fringe_scan(scanfile).get("refant") or get_refant()
+    chain = lambda upto: gain_chain(data, experiment, upto)
+    scanfile = f"{basedir}/{workdir}/{experiment}.fringe_scan.json"
+    # Parameters changing the result of a step, see pipeline.step_key; the
+    # reference antennas 'auto' ranks from the MS, an input of those steps
+    params = {
+        "fringe_sbd": {"refant": refant, "minsnr": 50},
+        "fringe_mbd": {"refant": refant, "fields": calibrators, "minsnr": 5},
+        "bandpass": {"refant": refant},
+        "diagnostics": {"refant": refant},
+        "export_products": {
+            "timebin": timebin,
+            "width": width,
+            "calibrators": calibrators,
+        },
+    }
 
-    if is_in_steps("flag_autocorrelation"):
-        if verbose:
-            print("Flagging autocorrelation")
-        _f.flag_autocorrelation(vis)
+    run = {
+        "unzip_gz": lambda: _f.gunzip(basedir, calibdir, max_workers=max_workers),
+        "check_tsys_gaincurve": lambda: _f.append_tsys_gaincurve(
+            basedir, calibdir, experiment, idifiles, max_workers=max_workers
+        ),
+        "convert_flag": lambda: _f.convert_flag(
+            basedir, calibdir, workdir, experiment, idifiles
+        ),
+        "import_fits_idi": lambda: _f.import_fits_idi(
+            basedir, fitsdir, workdir, experiment, vis, idifiles
+        ),
+        "gen_list_of_scans": lambda: _f.gen_list_of_scans(
+            basedir, calibdir, experiment, vis
+        ),
+        "partition_ms": lambda: _f.partition_ms(vis, mms, separationaxis=partition),
+        "flag_data": lambda: _f.flag_data(basedir, workdir, experiment, data),
+        "validate": lambda: _f.validate(
+            basedir, calibdir, workdir, experiment, vis, idifiles, get_gcfile()
+        ),
+        "gen_cal": lambda: _f.gen_cal(
+            data, tsystab, gcaltab, gcfile=get_gcfile(), aliases=aliases
+        ),
+        "apply_cal": lambda: _f.apply_cal(data, tsystab, gcaltab),
+        "flag_autocorrelation": lambda: _f.flag_autocorrelation(data),
+        "flagquack_intervals": lambda: _f.flagquack_intervals(data, quack=False),
+        "fringe_sbd": lambda: _f.fringe_sbd(
+            data,
+            sbdtab,
+            chain("sbd"),
+            get_refant(),
+            scanfile,
+            minsnr=params["fringe_sbd"]["minsnr"],
+            aliases=aliases,
+            flagstamp=flagstamp(),
+        ),
+        "fringe_mbd": lambda: _f.fringe_mbd(
+            data,
+            mbdtab,
+            chain("mbd"),
+            sbd_refant(),
+            calibrators,
+            minsnr=params["fringe_mbd"]["minsnr"],
+            scanfile=scanfile,
+            aliases=aliases,
+            flagstamp=flagstamp(),
+        ),
+        "bandpass": lambda: _f.bandpass_cal(
+            data,
+            bpasstab,
+            chain("bpass"),
+            sbd_refant(),
+            scanfile=scanfile,
+            aliases=aliases,
+            flagstamp=flagstamp(),
+        ),
+        "apply_final": lambda: _f.apply_final(data, chain("all")),
+        "diagnostics": lambda: _f.diagnostic_plots(
+            data,
+            sbd_refant(),
+            f"{basedir}/{workdir}/diagnostics",
+            gaintables=chain("all")["gaintable"],
+            max_workers=max_workers,
+            aliases=aliases,
+        ),
+        "export_products": lambda: _f.export_products(
+            data,
+            f"{basedir}/{workdir}/products",
+            experiment,
+            exclude=(calibrators or []) + [_f.fringe_finder(scanfile)],
+            timebin=timebin,
+            width=width,
+            max_workers=max_workers,
+        ),
+        "merge_mms": lambda: _f.merge_mms(mms, vis),
+    }
+    statefile = f"{basedir}/{workdir}/{experiment}.state.json"
+    if incremental:
+        run["import_fits_idi"] = lambda: import_incremental(
+            experiment,
+            vis,
+            tsystab,
+            gcaltab,
+            idifiles,
+            statefile,
+            replay=not mms,
+            aliases=aliases,
+        )
+    if io_slots is not None:
+        limited = lambda func: lambda: _with(io_slots, func)
+        run.update({name: limited(run[name]) for name in io_heavy_steps})
 
-    if is_in_steps("flagquack_intervals"):
+    io = get_step_io(experiment, vis, tsystab, gcaltab, idifiles, mms=mms)
+    step_vis = lambda name: data if name in mms_steps else vis
+    # The flags the tables are solved on, identified by the stamp of the
+    # last step writing the MS before fringe_sbd, see funcs._solve
+    flagger = [n for n in order[: order.index("fringe_sbd")] if data in io[n][1]][-1]
+    flagstamp = lambda: _p.load_state(statefile).get(flagger, {}).get("stamp")
+    pipeline_steps = {
+        name: {
+            "run": _i.traced_step(name, run[name], step_vis(name), disk=disks),
+            "inputs": io[name][0],
+            "outputs": io[name][1],
+            "desc": steps_desc[name],
+            "after": ["validate"] if name in io_heavy_steps else [],
+            "params": params.get(name),
+        }
+        for name in order
+    }
+    tracefile = f"{basedir}/{workdir}/{experiment}.trace.jsonl"
+    features = lambda: _pl.experiment_features(
+        idifiles,
+        uvflgfile=f"{basedir}/{calibdir}/{experiment}.uvflg",
+        gzfiles=glob.glob(f"{basedir}/{calibdir}/*.gz"),
+        cache=f"{basedir}/{workdir}/{experiment}.idi_headers.json",
+    )
+    if dry_run:
+        entries = _p.plan(order, pipeline_steps, steps, statefile, force=force)
+        if cost_model is not None:
+            model = _pl.load_model(cost_model)
+        else:
+            model = _pl.fit_model([tracefile] if os.path.isfile(tracefile) else [])
+        totals = _pl.estimate(entries, features(), model)
         if verbose:
-            print("Flagging quack intervals")
-        _f.flagquack_intervals(vis)
+            _p.print_plan(entries)
+            _pl.print_totals(totals)
+        return entries
 
-    if is_in_steps(""):
-        pass
+    patterns = staged_patterns(experiment)
+    stage = lambda name, src, dst, remove=True: _i.traced_step(
+        name,
+        lambda: _scratch.mirror(
+            patterns, src, dst, max_workers=max_workers, remove=remove
+        ),
+        disk=disks,
+    )
+    stage_in = stage("stage_in", archive, datadir)
+    stage_out = stage("stage_out", datadir, archive)
+    # After a failure, a step may have removed data it did not write again
+    copy_back = stage("stage_out", datadir, archive, remove=False)
+    if io_slots is not None:
+        stage_in, stage_out = limited(stage_in), limited(stage_out)
+        copy_back = limited(copy_back)
 
-    # if is_in_steps(''):
-    #     pass
+    # The inputs as given, before unzip_gz removes the compressed files
+    run_features = features()
+    _i.set_trace_file(tracefile)
+    first_record = len(_i.records)
+    staged = completed = False
+    try:
+        if scratch:
+            stage_in()
+            staged = True
+        state = _p.run_pipeline(
+            order,
+            pipeline_steps,
+            steps,
+            statefile,
+            force=force,
+            verbose=verbose,
+            max_concurrency=max_concurrency,
+            aliases=aliases,
+        )
+        if prune_flags:
+            for ms in dict.fromkeys([data, vis]):
+                if os.path.isdir(ms):
+                    _f.prune_flag_versions(ms)
+        completed = True
+        return state
+    finally:
+        # Only after a complete stage in and run, mirroring removes what is
+        # missing
+        if staged:
+            (stage_out if completed else copy_back)()
+        # Closes the run, for the cost model of the planner
+        _i.emit({"name": experiment, "kind": "run", "features": run_features})
+        if verbose:
+            _i.summary(_i.records[first_record:])
 
 
 if __name__ == "__main__":
@@ -162,9 +591,135 @@ if __name__ == "__main__":
         default=get_steps(),
         help="Steps to be run",
     )
+    parser.add_argument(
+        "-j",
+        "--max-workers",
+        type=int,
+        default=1,
+        help="Number of worker processes for per-file steps",
+    )
+    parser.add_argument(
+        "--batch-workers",
+        type=int,
+        default=2,
+        help="Number of experiments processed at once, given several",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Rerun the selected steps even if their inputs did not change",
+    )
+    parser.add_argument(
+        "-c",
+        "--max-concurrency",
+        type=int,
+        default=1,
+        help="Number of independent steps allowed to run at once",
+    )
+    parser.add_argument(
+        "-r",
+        "--refant",
+        type=str,
+        default="EF",
+        help="Reference antenna(s), or 'auto' to rank them from the data",
+    )
+    parser.add_argument(
+        "-p",
+        "--partition",
+        type=str,
+        choices=["scan", "spw", "auto"],
+        default=None,
+        help="Partition the MS into a multi-MS for mpicasa along this axis",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Import only the FITS-IDI files not in the MS yet",
+    )
+    parser.add_argument(
+        "--timebin", type=str, default="0s", help="Averaging time of the products"
+    )
+    parser.add_argument(
+        "--width", type=int, default=1, help="Channels averaged in the products"
+    )
+    parser.add_argument(
+        "-b",
+        "--calibrators",
+        nargs="+",
+        type=str,
+        default=None,
+        help="Fields of the multi-band delay fringe fit",
+    )
+    parser.add_argument(
+        "--dry-run",
+        "--plan",
+        action="store_true",
+        help="Print the steps that would run and their paths, without running",
+    )
+    parser.add_argument(
+        "--cost-model",
+        type=str,
+        default=None,
+        help="Cost model of the dry run (see planner), default from past runs",
+    )
+    parser.add_argument(
+        "--scratch",
+        type=str,
+        default=None,
+        help="Fast local directory to stage the MS and calibration tables in",
+    )
+    parser.add_argument(
+        "--prune-flags",
+        action="store_true",
+        help="Delete the intermediate flag versions at the end",
+    )
+    parser.add_argument(
+        "--keep-mms",
+        action="store_true",
+        help="Keep working on the multi-MS instead of merging it back",
+    )
 
     args = parser.parse_args()
-    run_steps(args.experiment, args.steps)
+    run_kwargs = dict(
+        steps=args.steps,
+        max_workers=args.max_workers,
+        force=args.force,
+        max_concurrency=args.max_concurrency,
+        refant=args.refant,
+        partition=args.partition,
+        merge=not args.keep_mms,
+        incremental=args.incremental,
+        timebin=args.timebin,
+        width=args.width,
+        calibrators=args.calibrators,
+        scratch=args.scratch,
+        prune_flags=args.prune_flags,
+    )
+    if args.dry_run:
+        for experiment in args.experiment:
+            if len(args.experiment) > 1:
+                print(f"{experiment}:")
+                set_dirs(f"{os.path.dirname(basedir)}/{experiment}", workdir)
+            run_steps(
+                experiment, dry_run=True, cost_model=args.cost_model, **run_kwargs
+            )
+    elif len(args.experiment) == 1:
+        run_steps(args.experiment[0], **run_kwargs)
+    else:
+        # Sibling experiment directories, each with its own working directory
+        from . import batch
+
+        run_kwargs.pop("max_workers")
+        batch.run_batch(
+            args.experiment,
+            data=os.path.dirname(basedir),
+            work=workdir,
+            max_workers=args.batch_workers,
+            step_workers=args.max_workers,
+            **run_kwargs,
+        )
 
 
 # FRINGE FITTING
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from . import pipeline as _p
+
+store_dir = lambda caltable: f"{os.path.dirname(os.path.abspath(caltable))}/caltables"
+
+
+def table_key(task, params, inputs, aliases=None):
+    """Key of a calibration table: task, parameters and input fingerprints
+
+    Inputs are identified by their path as recorded in the pipeline state
+    (see pipeline.logical_path), so that a table solved on data staged
+    elsewhere has the same key.
+
+    Parameters
+    ----------
+        task: str
+        params: dict
+            task parameters, JSON serialisable
+        inputs: list
+            files or directories the table is derived from (MS or MS
+            subtables, upstream gain tables, ...)
+        aliases: dict
+            see pipeline.logical_path (default: None)
+    """
+    h = hashlib.sha1(task.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    for path in inputs:
+        h.update(f"{_p.logical_path(path, aliases)}={_p.fingerprint(path)};".encode())
+    return h.hexdigest()
+
+
+def _link(caltable, target):
+    """Point caltable at a table of the store, replacing what was there"""
+    if os.path.islink(caltable) or os.path.isfile(caltable):
+        os.remove(caltable)
+    elif os.path.isdir(caltable):
+        shutil.rmtree(caltable)
+    tmp = f"{caltable}.link"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    caldir = os.path.dirname(os.path.abspath(caltable))
+    os.symlink(os.path.relpath(target, caldir), tmp)
+    os.replace(tmp, caltable)
+
+
+def solve(caltable, make, task, params, inputs, storedir=None, aliases=None):
+    """Make a calibration table, or reuse one made from the same inputs
+
+    Tables are kept in a content-addressed store, one directory per key
+    (see table_key), and caltable is made a symbolic link to the entry.
+    Solving again with unchanged inputs, or going back to an earlier
+    parameter variant, links the existing entry instead of running the
+    task.
+
+    Parameters
+    ----------
+        caltable: str
+            path the table is expected at
+        make: callable
+            make(path) writes the table to path
+        task, params, inputs, aliases
+            see table_key
+        storedir: str
+            (default: caltables next to caltable)
+
+    Returns
+    -------
+        str: path of the store entry
+    """
+    storedir = storedir or store_dir(caltable)
+    os.makedirs(storedir, exist_ok=True)
+    key = table_key(task, params, inputs, aliases=aliases)
+    name = os.path.basename(caltable)
+    entry = f"{storedir}/{name}.{key[:16]}"
+    if os.path.isdir(entry):
+        print(f"✅ {name}: reusing the table solved from the same inputs")
+    else:
+        tmp = f"{entry}.tmp"
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        make(tmp)
+        os.replace(tmp, entry)
+        with open(f"{entry}.json", "w") as f:
+            json.dump(
+                {
+                    "task": task,
+                    "params": params,
+                    "inputs": [_p.logical_path(p, aliases) for p in inputs],
+                    "key": key,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                f,
+                indent=1,
+                default=str,
+            )
+    _link(caltable, entry)
+    return entry
+
+
+def entries(storedir):
+    """Tables of a store with their task, parameters and inputs"""
+    tables = {}
+    for name in sorted(os.listdir(storedir)):
+        if name.endswith(".json"):
+            with open(f"{storedir}/{name}") as f:
+                tables[name[: -len(".json")]] = json.load(f)
+    return tables
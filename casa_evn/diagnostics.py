@@ -0,0 +1,415 @@
+import os
+import re
+import html
+import hashlib
+import numpy as np
+from . import metadata as _md
+from . import pipeline as _p
+from . import instrument as _i
+from . import selection as _sel
+
+# Size above which the least recently used averages are evicted
+cache_max_bytes = 2 * 1024**3
+
+plot_types = {
+    "phase_freq": ("frequency", "phase"),
+    "amp_freq": ("frequency", "amplitude"),
+    "phase_time": ("time", "phase"),
+    "amp_time": ("time", "amplitude"),
+}
+
+
+def channel_frequencies(spw):
+    """Channel centres [GHz] of a spectral window of the metadata index"""
+    width = spw["bandwidth"] / spw["nchan"]
+    offsets = (np.arange(spw["nchan"]) + 0.5 - spw["nchan"] / 2) * width
+    return (spw["meanfreq"] + offsets) / 1e9
+
+
+def _group_sum(keys, values, counts):
+    """Sum values and counts over the rows sharing the same key columns"""
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    vsum = np.zeros((len(unique),) + values.shape[1:], dtype=values.dtype)
+    nsum = np.zeros((len(unique),) + counts.shape[1:], dtype=counts.dtype)
+    np.add.at(vsum, inverse, values)
+    np.add.at(nsum, inverse, counts)
+    return unique, vsum, nsum
+
+
+def average_baselines(
+    vis, refant, avgtime=600.0, datacolumn=None, chunksize=None
+):
+    """Averaged visibilities of the baselines to refant, in one chunked pass
+
+    The parallel hands are vector averaged over unflagged data, over
+    avgtime bins per channel (for plots against frequency), and over all
+    channels and spectral windows per integration (for plots against
+    time).
+
+    Parameters
+    ----------
+        vis: str
+        refant: str
+        avgtime: float
+            length [s] of the time bins of the spectra (default: 600)
+        datacolumn: str
+            (default: CORRECTED_DATA if present, else DATA)
+        chunksize: int
+            number of rows per read (default: None, about
+            metadata.chunk_bytes per chunk)
+
+    Returns
+    -------
+        dict: (field id, antenna id) -> {"time", "scan", "vis" (ntime, 2),
+        "spectra": list of (time bin, spw id, vis (2, nchan))}
+    """
+    from casatools import table
+
+    index = _md.get_index(vis)
+    ref = index["antennas"].index(refant)
+    t0 = min((s["start"] for s in index["scans"]), default=0.0)
+    nchan = max(_md.nchan(index), default=1)
+    chunksize = chunksize or _md.chunk_rows(nchan, _sel.pass_bytes_per_value)
+
+    tb = table()
+    tb.open(vis)
+    if datacolumn is None:
+        corrected = "CORRECTED_DATA" in tb.colnames()
+        datacolumn = "CORRECTED_DATA" if corrected else "DATA"
+    rows, spectra = [], []
+    for ddid, spw in enumerate(index["datadesc_spw"]):
+        sub = tb.query(
+            f"DATA_DESC_ID=={ddid} && ANTENNA1!=ANTENNA2 "
+            f"&& (ANTENNA1=={ref} || ANTENNA2=={ref})"
+        )
+        for startrow in range(0, sub.nrows(), chunksize):
+            nrow = min(chunksize, sub.nrows() - startrow)
+            get = lambda col: sub.getcol(col, startrow=startrow, nrow=nrow)
+            a1, a2 = get("ANTENNA1"), get("ANTENNA2")
+            ant = np.where(a1 == ref, a2, a1)
+            time, field, scan = get("TIME"), get("FIELD_ID"), get("SCAN_NUMBER")
+            data, flag = get(datacolumn), get("FLAG")
+            corr = _sel._parallel_hands(data.shape[0])
+            good = ~flag[corr]
+            data = np.where(good, data[corr], 0)
+
+            # Per integration, averaged over channels (and spws below)
+            keys = np.stack([field, ant, time, scan], axis=1)
+            rows.append(_group_sum(keys, data.sum(axis=1).T, good.sum(axis=1).T))
+
+            # Per avgtime bin and channel
+            tbin = np.floor((time - t0) / avgtime)
+            keys = np.stack([field, ant, tbin], axis=1)
+            unique, vsum, nsum = _group_sum(
+                keys, data.transpose(2, 0, 1), good.transpose(2, 0, 1)
+            )
+            spectra += zip(map(tuple, unique), [spw] * len(unique), vsum, nsum)
+        sub.close()
+    tb.close()
+
+    result = {}
+    if rows:
+        keys = np.concatenate([k for k, _, _ in rows])
+        unique, vsum, nsum = _group_sum(
+            keys,
+            np.concatenate([v for _, v, _ in rows]),
+            np.concatenate([n for _, _, n in rows]),
+        )
+        mean = np.where(nsum > 0, vsum / np.maximum(nsum, 1), np.nan)
+        for f, a in {(int(k[0]), int(k[1])) for k in unique}:
+            sel = (unique[:, 0] == f) & (unique[:, 1] == a)
+            result[f, a] = {
+                "time": unique[sel, 2],
+                "scan": unique[sel, 3].astype(int),
+                "vis": mean[sel],
+                "spectra": [],
+            }
+
+    # Bins of the same field, antenna and spw split over chunks are merged
+    merged = {}
+    for (f, a, b), spw, v, n in spectra:
+        key = (int(f), int(a), int(b), spw)
+        if key in merged:
+            merged[key] = (merged[key][0] + v, merged[key][1] + n)
+        else:
+            merged[key] = (v, n)
+    for (f, a, b, spw), (v, n) in sorted(merged.items()):
+        mean = np.where(n > 0, v / np.maximum(n, 1), np.nan)
+        result[f, a]["spectra"].append((b, spw, mean))
+    return result
+
+
+def cache_key(vis, refant, avgtime, datacolumn, gaintables=(), aliases=None):
+    """Key of the averaged visibilities of an MS in a calibration state
+
+    Paths are mapped through pipeline.logical_path with aliases, so that
+    data staged elsewhere has the same key.
+    """
+    h = hashlib.sha1(f"{refant}:{avgtime}:{datacolumn}".encode())
+    for path in [vis] + list(gaintables):
+        h.update(f"{_p.logical_path(path, aliases)}={_p.fingerprint(path)};".encode())
+    return h.hexdigest()
+
+
+def _save_averaged(path, averaged):
+    arrays = {}
+    for (f, a), d in averaged.items():
+        prefix = f"{f}_{a}"
+        for name in ("time", "scan", "vis"):
+            arrays[f"{prefix}_{name}"] = d[name]
+        for spw in sorted({spw for _, spw, _ in d["spectra"]}):
+            spectra = [(b, v) for b, s, v in d["spectra"] if s == spw]
+            arrays[f"{prefix}_spw{spw}_bins"] = np.array([b for b, _ in spectra])
+            arrays[f"{prefix}_spw{spw}_vis"] = np.stack([v for _, v in spectra])
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def _load_averaged(path):
+    averaged = {}
+    with np.load(path) as npz:
+        for name in npz.files:
+            f, a, rest = name.split("_", 2)
+            d = averaged.setdefault(
+                (int(f), int(a)), {"time": None, "scan": None, "vis": None}
+            )
+            if rest.startswith("spw") and rest.endswith("_bins"):
+                spw = int(rest[3 : -len("_bins")])
+                vis = npz[f"{f}_{a}_spw{spw}_vis"]
+                spectra = d.setdefault("spectra", [])
+                spectra += [(int(b), spw, v) for b, v in zip(npz[name], vis)]
+            elif not rest.startswith("spw"):
+                d[rest] = npz[name]
+    for d in averaged.values():
+        d.setdefault("spectra", [])
+        d["spectra"].sort(key=lambda s: (s[0], s[1]))
+    return averaged
+
+
+def evict(cachedir, max_bytes=cache_max_bytes):
+    """Remove the least recently used entries above max_bytes in total"""
+    entries = [
+        (os.stat(p).st_mtime, os.path.getsize(p), p)
+        for p in (os.path.join(cachedir, n) for n in os.listdir(cachedir))
+        if p.endswith(".npz")
+    ]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def cached_average(
+    vis,
+    refant,
+    avgtime=600.0,
+    datacolumn=None,
+    gaintables=(),
+    cachedir=None,
+    max_bytes=cache_max_bytes,
+    aliases=None,
+):
+    """average_baselines, cached on disk per calibration state
+
+    Entries are NPZ files keyed by the fingerprints of the MS and of the
+    gain tables applied to it (see cache_key), so that plots made again
+    after a calibration stage only read the MS once.
+
+    Parameters
+    ----------
+        vis, refant, avgtime, datacolumn
+            see average_baselines
+        gaintables: list
+            calibration tables applied to the corrected data
+        cachedir: str
+            (default: avgcache next to the MS)
+        max_bytes: int
+            size above which the least recently used entries are removed
+        aliases: dict
+            see cache_key (default: None)
+
+    Returns
+    -------
+        dict: see average_baselines
+    """
+    cachedir = cachedir or f"{os.path.dirname(os.path.abspath(vis))}/avgcache"
+    os.makedirs(cachedir, exist_ok=True)
+    key = cache_key(vis, refant, avgtime, datacolumn, gaintables, aliases=aliases)
+    path = f"{cachedir}/{key}.npz"
+    if os.path.isfile(path):
+        os.utime(path)
+        return _load_averaged(path)
+
+    averaged = average_baselines(vis, refant, avgtime=avgtime, datacolumn=datacolumn)
+    _save_averaged(path, averaged)
+    evict(cachedir, max_bytes)
+    return averaged
+
+
+_phase = lambda v: np.degrees(np.angle(v))
+
+
+def _safe(name):
+    return re.sub(r"[^\w.+-]", "_", name)
+
+
+def render_baseline(outdir, field, refant, antenna, averaged, spws, t0=0.0):
+    """Write the PNG files of the four plot types of one baseline
+
+    Runs in a worker process; matplotlib is imported here, with the
+    non-interactive Agg backend. Time is plotted in hours since t0 (MJD
+    seconds, the start of the first scan), which does not wrap at 0 UT.
+
+    Returns
+    -------
+        dict: plot type -> PNG file name (relative to outdir)
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    files = {}
+    title = f"{field}: {refant}-{antenna}"
+    cmap = plt.get_cmap("tab10")
+    for kind, (xaxis, yaxis) in plot_types.items():
+        fig, ax = plt.subplots(figsize=(7, 4))
+        value = _phase if yaxis == "phase" else np.abs
+        if xaxis == "frequency":
+            for _, spw, v in averaged["spectra"]:
+                freq = channel_frequencies(spws[spw])
+                for c, marker in zip(range(v.shape[0]), ".x"):
+                    color = cmap(spw % 10)
+                    ax.plot(freq, value(v[c]), marker, ms=2, color=color)
+            ax.set_xlabel("Frequency [GHz]")
+        else:
+            hours = (averaged["time"] - t0) / 3600
+            colors = cmap(averaged["scan"] % 10)
+            for c, marker in zip(range(averaged["vis"].shape[1]), ".x"):
+                ax.scatter(
+                    hours,
+                    value(averaged["vis"][:, c]),
+                    s=3,
+                    marker=marker,
+                    c=colors,
+                )
+            start = str(_md.mjd_to_casa(t0))
+            ax.set_xlabel(f"Time since {start} UT [h]")
+        ax.set_ylabel("Phase [deg]" if yaxis == "phase" else "Amplitude")
+        if yaxis == "phase":
+            ax.set_ylim(-180, 180)
+        ax.set_title(title)
+        name = f"{_safe(field)}_{_safe(refant)}-{_safe(antenna)}_{kind}.png"
+        fig.savefig(f"{outdir}/{name}", dpi=100, bbox_inches="tight")
+        plt.close(fig)
+        files[kind] = name
+    return files
+
+
+def write_index(outdir, vis, refant, pages):
+    """Write index.html: per field, one row per baseline and plot type
+
+    Parameters
+    ----------
+        pages: dict
+            field name -> {antenna name: {plot type: PNG file name}}
+    """
+    esc = html.escape
+    lines = [
+        "<!DOCTYPE html>",
+        f"<html><head><meta charset='utf-8'><title>{esc(vis)}</title>",
+        "<style>img{width:320px}td,th{padding:2px;text-align:center}</style>",
+        f"</head><body><h1>{esc(os.path.basename(vis))}, baselines to "
+        f"{esc(refant)}</h1>",
+    ]
+    for field, baselines in pages.items():
+        lines.append(f"<h2>{esc(field)}</h2><table><tr><th>baseline</th>")
+        lines += [f"<th>{esc(kind)}</th>" for kind in plot_types]
+        lines.append("</tr>")
+        for antenna, files in baselines.items():
+            lines.append(f"<tr><td>{esc(refant)}-{esc(antenna)}</td>")
+            for kind in plot_types:
+                src = esc(files[kind])
+                lines.append(f"<td><a href='{src}'><img src='{src}'></a></td>")
+            lines.append("</tr>")
+        lines.append("</table>")
+    lines.append("</body></html>")
+    with open(f"{outdir}/index.html", "w") as f:
+        f.write("\n".join(lines))
+
+
+def plot_baselines(
+    vis,
+    refant,
+    outdir,
+    fields=None,
+    avgtime=600.0,
+    gaintables=(),
+    max_workers=4,
+    aliases=None,
+):
+    """Render the diagnostic plots of every baseline to refant, per field
+
+    The MS is read once (see cached_average); the phase and amplitude
+    against frequency and time plots of each baseline are rendered to PNG
+    files by a pool of worker processes, and linked from
+    {outdir}/index.html.
+
+    Parameters
+    ----------
+        vis: str
+        refant: str
+        outdir: str
+        fields: list
+            fields to be plotted (names or ids, default: all)
+        avgtime: float
+            averaging time [s] of the spectra (default: 600)
+        gaintables: list
+            calibration tables applied to the corrected data, part of the
+            cache key
+        max_workers: int
+            Number of worker processes (default: 4)
+        aliases: dict
+            see cache_key (default: None)
+
+    Returns
+    -------
+        str: path of the HTML index
+    """
+    index = _md.get_index(vis)
+    t0 = min((s["start"] for s in index["scans"]), default=0.0)
+    os.makedirs(outdir, exist_ok=True)
+    averaged = cached_average(
+        vis, refant, avgtime=avgtime, gaintables=gaintables, aliases=aliases
+    )
+    if fields is not None:
+        fids = {_md.field_id(index, f) for f in fields}
+        averaged = {k: v for k, v in averaged.items() if k[0] in fids}
+
+    pages = {}
+    with _i.process_pool(max_workers) as pool:
+        futures = {
+            (f, a): pool.submit(
+                render_baseline,
+                outdir,
+                index["fields"][f],
+                refant,
+                index["antennas"][a],
+                data,
+                index["spws"],
+                t0,
+            )
+            for (f, a), data in sorted(averaged.items())
+        }
+        for (f, a), future in futures.items():
+            field, antenna = index["fields"][f], index["antennas"][a]
+            pages.setdefault(field, {})[antenna] = future.result()
+
+    write_index(outdir, vis, refant, pages)
+    nplots = sum(len(b) for b in pages.values()) * len(plot_types)
+    print(f"✅ {nplots} plots written, see {outdir}/index.html")
+    return f"{outdir}/index.html"
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import traceback
+from . import metadata as _md
+from . import diagnostics as _diag
+from . import pipeline as _p
+from . import instrument as _i
+
+manifest_name = "products.json"
+
+
+def target_fields(index, exclude=()):
+    """Fields to be exported, from the metadata index
+
+    Fields only observed with calibration intents, and those in exclude
+    (names), are left out. Without intents in the MS only those in exclude
+    are.
+    """
+    calibrators = set(exclude) | set(_md.calibrator_fields(index))
+    return [f for f in index["fields"] if f not in calibrators]
+
+
+def product_key(ms_fingerprint, field, params):
+    """Key of a product: MS fingerprint, field and export parameters"""
+    h = hashlib.sha1(f"{field}:{json.dumps(params, sort_keys=True)}".encode())
+    h.update(f"{ms_fingerprint}".encode())
+    return h.hexdigest()
+
+
+def _export(vis, field, outputvis, fitsfile, params):
+    """split one field and export it to UVFITS; runs in a worker process"""
+    from casatasks import exportuvfits, split
+
+    start = time.perf_counter()
+    result = {"field": field, "ms": outputvis, "uvfits": fitsfile, "error": None}
+    try:
+        for path in (outputvis, fitsfile):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+        split(
+            vis=vis,
+            outputvis=outputvis,
+            field=field,
+            datacolumn="corrected",
+            timebin=params["timebin"],
+            width=params["width"],
+            keepflags=False,
+        )
+        exportuvfits(
+            vis=outputvis,
+            fitsfile=fitsfile,
+            datacolumn="data",
+            multisource=False,
+            combinespw=True,
+            padwithflags=True,
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    result["wall_s"] = round(time.perf_counter() - start, 1)
+    return result
+
+
+def export_products(
+    vis,
+    outdir,
+    prefix,
+    fields=None,
+    exclude=(),
+    timebin="0s",
+    width=1,
+    max_workers=2,
+):
+    """Calibrated MS and UVFITS file of every target field
+
+    Each field is split from the corrected data, optionally averaged, and
+    exported by a worker process. A product is skipped when the MS and the
+    export parameters did not change since it was made, as recorded in
+    {outdir}/products.json.
+
+    Parameters
+    ----------
+        vis: str
+        outdir: str
+        prefix: str
+            products are {outdir}/{prefix}_{field}.ms and .uvfits
+        fields: list
+            field names (default: target_fields of the MS)
+        exclude: list
+            calibrator names left out of the default fields (default: none)
+        timebin: str
+            averaging time, e.g. '4s' (default: '0s', none)
+        width: int
+            number of channels averaged together (default: 1, none)
+        max_workers: int
+            Number of fields exported at once (default: 2)
+
+    Returns
+    -------
+        dict: field -> product record (ms, uvfits, key, error, wall_s)
+    """
+    index = _md.get_index(vis)
+    fields = fields if fields is not None else target_fields(index, exclude)
+    params = {"timebin": timebin, "width": width}
+    os.makedirs(outdir, exist_ok=True)
+    manifest = f"{outdir}/{manifest_name}"
+    products = {}
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            products = json.load(f)
+
+    ms_fingerprint = _p.fingerprint(vis)
+    jobs = {}
+    for field in fields:
+        base = f"{outdir}/{prefix}_{_diag._safe(field)}"
+        key = product_key(ms_fingerprint, field, params)
+        done = products.get(field, {})
+        if (
+            done.get("key") == key
+            and not done.get("error")
+            and all(os.path.exists(done[p]) for p in ("ms", "uvfits"))
+        ):
+            print(f"✅ {field}: product unchanged, skipping")
+            continue
+        jobs[field] = (f"{base}.ms", f"{base}.uvfits", key)
+
+    with _i.process_pool(max_workers) as pool:
+        futures = {
+            field: pool.submit(_export, vis, field, ms, uvfits, params)
+            for field, (ms, uvfits, _) in jobs.items()
+        }
+        for field, future in futures.items():
+            result = future.result()
+            result["key"] = jobs[field][2]
+            products[field] = result
+            mark = "✅" if result["error"] is None else "🛑"
+            print(f"{mark} {field}: {result['error'] or result['uvfits']}")
+
+    with open(manifest, "w") as f:
+        json.dump(products, f, indent=1)
+    failed = [f for f in fields if products[f].get("error")]
+    if failed:
+        raise RuntimeError(f"export failed for {', '.join(failed)}")
+    return {f: products[f] for f in fields}
@@ -0,0 +1,286 @@
+import re
+import numpy as np
+from . import metadata as _md
+from . import idi as _idi
+
+_keyvalue = re.compile(r"(\w+)\s*=\s*('[^']*'|[^=']*?)(?=\s+\w+\s*=|\s*$)")
+
+
+def _read_idi_tables(idifile):
+    """Reference date, frequency setup and antenna names of a FITS-IDI file
+
+    Returns
+    -------
+        rdate, nspw, nchan, antenna_names: str, int, int, dict
+    """
+    info = _idi.inspect([idifile])[idifile]
+    antenna_names = {n: name for n, name in info["antennas"]}
+    return info["rdate"], info["nspw"], info["nchan"], antenna_names
+
+
+def _timerang(value):
+    # d1,h1,m1,s1, d2,h2,m2,s2 -> seconds since the reference day
+    v = [float(x) for x in value.replace(",", " ").split()]
+    v += [0.0] * (8 - len(v))
+    to_s = lambda d, h, m, s: ((d * 24 + h) * 60 + m) * 60 + s
+    return to_s(*v[:4]), to_s(*v[4:])
+
+
+def _antenna_list(kv, namekey, numkey, antenna_names):
+    """Antenna names of a UVFLG entry, [''] for all antennas
+
+    ANT_NAME/BAS_NAME give one name; ANTENNAS/BASELINE are AIPS arrays,
+    e.g. 3,5,0, whose zeros are unused slots.
+    """
+    if kv.get(namekey):
+        return [n.strip() for n in kv[namekey].split(",") if n.strip()]
+    numbers = [int(float(x)) for x in (kv.get(numkey) or "0").split(",") if x.strip()]
+    names = [antenna_names.get(n, "") for n in numbers if n > 0]
+    return names or [""]
+
+
+def parse_uvflg(uvflgfile, nspw, nchan, antenna_names=None):
+    """Parse an AIPS UVFLG file into arrays
+
+    Parameters
+    ----------
+        uvflgfile: str
+        nspw, nchan: int
+            number of spectral windows and channels per window
+        antenna_names: dict
+            antenna number -> name, to resolve ANTENNAS/BASELINE numbers
+
+    Returns
+    -------
+        dict of arrays: ant, bl (names, '' for all), t0, t1 (seconds since
+        the reference day, t1 < 0 for all times), spw0, spw1, ch0, ch1
+        (0-based, inclusive), stokes
+    """
+    antenna_names = antenna_names or {}
+    with open(uvflgfile) as f:
+        text = " ".join(line.split("!")[0] for line in f)
+
+    rows = []
+    for entry in text.split("/"):
+        kv = {k.lower(): v.strip("' ") for k, v in _keyvalue.findall(entry)}
+        if not kv:
+            continue
+        num = lambda key: int(float(kv.get(key) or 0))
+        t0, t1 = _timerang(kv.get("timerang", "0"))
+        if t0 == 0 and t1 == 0:
+            t0, t1 = 0.0, -1.0
+        selection = (
+            t0,
+            t1,
+            max(num("bif"), 1) - 1,
+            num("eif") - 1 if num("eif") > 0 else nspw - 1,
+            max(num("bchan"), 1) - 1,
+            num("echan") - 1 if num("echan") > 0 else nchan - 1,
+            kv.get("stokes", "").upper(),
+        )
+        # One row per listed antenna and baseline antenna, '' for all
+        for ant in _antenna_list(kv, "ant_name", "antennas", antenna_names):
+            for bl in _antenna_list(kv, "bas_name", "baseline", antenna_names):
+                rows.append((ant, bl, *selection))
+
+    fields = ["ant", "bl", "t0", "t1", "spw0", "spw1", "ch0", "ch1", "stokes"]
+    columns = list(zip(*rows)) if rows else [[]] * len(fields)
+    dtypes = [str, str, float, float, int, int, int, int, str]
+    return {f: np.asarray(c, dtype=d) for f, c, d in zip(fields, columns, dtypes)}
+
+
+def merge_intervals(flags, tolerance=1.0):
+    """Merge overlapping or adjacent time ranges sharing the same selection
+
+    Parameters
+    ----------
+        flags: dict of arrays
+            as returned by parse_uvflg
+        tolerance: float
+            gap [s] below which consecutive ranges are merged
+
+    Returns
+    -------
+        dict of arrays: merged flags
+    """
+    n = len(flags["t0"])
+    if n == 0:
+        return flags
+    keys = ["ant", "bl", "spw0", "spw1", "ch0", "ch1", "stokes"]
+    codes = [np.unique(flags[k], return_inverse=True)[1] for k in keys]
+    group = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)[1]
+    group = group.ravel()
+
+    take = lambda idx: {k: v[idx] for k, v in flags.items()}
+
+    # Flags over all times swallow every other range of their group
+    alltime = flags["t1"] < 0
+    alltime_groups, first = np.unique(group[alltime], return_index=True)
+    kept_alltime = np.flatnonzero(alltime)[first]
+    finite = np.flatnonzero(~alltime & ~np.isin(group, alltime_groups))
+
+    order = finite[np.lexsort((flags["t0"][finite], group[finite]))]
+    g, t0, t1 = group[order], flags["t0"][order], flags["t1"][order]
+    starts = np.zeros(0, dtype=int)
+    if len(order) > 0:
+        # Running end time within each group; offsetting each group keeps
+        # the cumulative maximum from leaking across group boundaries.
+        offset = g * (t1.max() + 2 * tolerance + 1)
+        end = np.maximum.accumulate(t1 + offset) - offset
+        gap = t0[1:] > end[:-1] + tolerance
+        new = np.concatenate([[True], (g[1:] != g[:-1]) | gap])
+        starts = np.flatnonzero(new)
+
+    merged = take(order[starts])
+    if len(starts) > 0:
+        merged["t1"] = np.maximum.reduceat(t1, starts)
+    return {k: np.concatenate([take(kept_alltime)[k], merged[k]]) for k in flags}
+
+
+def _casa_times(seconds, rdate):
+    ms = np.round(seconds * 1000).astype("timedelta64[ms]")
+    t = np.datetime64(rdate, "ms") + ms
+    iso = np.datetime_as_string(t, unit="s")
+    return np.char.replace(np.char.replace(iso, "-", "/"), "T", "/")
+
+
+def to_commands(flags, rdate, nspw, nchan):
+    """Format flags as flagdata list-mode commands"""
+    finite = flags["t1"] >= 0
+    begin = _casa_times(np.where(finite, flags["t0"], 0.0), rdate)
+    end = _casa_times(np.where(finite, flags["t1"], 0.0), rdate)
+    allspw = (flags["spw0"] == 0) & (flags["spw1"] == nspw - 1)
+    allchan = (flags["ch0"] == 0) & (flags["ch1"] == nchan - 1)
+
+    commands = []
+    for i in range(len(flags["t0"])):
+        ant, bl, stokes = flags["ant"][i], flags["bl"][i], flags["stokes"][i]
+        cmd = []
+        if ant or bl:
+            sel = f"{ant}&{bl}" if ant and bl else ant or bl
+            cmd.append(f"antenna='{sel}'")
+        if finite[i]:
+            cmd.append(f"timerange='{begin[i]}~{end[i]}'")
+        if not (allspw[i] and allchan[i]):
+            spw = f"{flags['spw0'][i]}~{flags['spw1'][i]}"
+            if not allchan[i]:
+                spw += f":{flags['ch0'][i]}~{flags['ch1'][i]}"
+            cmd.append(f"spw='{spw}'")
+        corr = [stokes[j : j + 2] for j in range(0, len(stokes), 2)]
+        if stokes and all(c in ("RR", "LL", "RL", "LR") for c in corr):
+            cmd.append(f"correlation='{','.join(corr)}'")
+        cmd.append("reason='UVFLG'")
+        commands.append(" ".join(cmd))
+    return commands
+
+
+def convert_uvflg(uvflgfile, idifiles, outfile, tolerance=1.0):
+    """Convert an AIPS UVFLG file to a merged flagdata command list
+
+    Time ranges of the same antenna/baseline, spw/channel range and
+    correlation that overlap or are less than tolerance seconds apart are
+    merged into a single command.
+
+    Parameters
+    ----------
+        uvflgfile: str
+        idifiles: list
+            FITS-IDI files, the first one provides the reference date,
+            frequency setup and antenna numbering
+        outfile: str
+            flag command list, as read by flagdata(mode='list')
+        tolerance: float
+            gap [s] below which consecutive ranges are merged (default: 1)
+
+    Returns
+    -------
+        int: number of flag commands written
+    """
+    rdate, nspw, nchan, antenna_names = _read_idi_tables(idifiles[0])
+    flags = parse_uvflg(uvflgfile, nspw, nchan, antenna_names)
+    merged = merge_intervals(flags, tolerance=tolerance)
+    commands = to_commands(merged, rdate, nspw, nchan)
+    with open(outfile, "w") as f:
+        f.writelines(f"{cmd}\n" for cmd in commands)
+
+    n_in, n_out = len(flags["t0"]), len(commands)
+    ratio = f" ({n_in / n_out:.1f}x fewer)" if n_out > 0 else ""
+    print(f"{n_in} UVFLG entries merged into {n_out} flag commands{ratio}")
+    return n_out
+
+
+def edge_channel_mask(nchan, edgefraction=0.1):
+    """Edge channels of a spectral window, as flagged by the pipeline
+
+    flagfraction = int(nchan / (100 * edgefraction)) channels are flagged
+    at each end of the band.
+    """
+    nedge = int(nchan / (100 * edgefraction))
+    mask = np.zeros(nchan, dtype=bool)
+    mask[:nedge] = True
+    mask[nchan - nedge :] = True
+    return mask
+
+
+def flag_autocorr_edges_quack(
+    vis, edgefraction=0.1, quackinterval=5.0, chunksize=None
+):
+    """Flag autocorrelations, edge channels and scan starts in a single pass
+
+    The FLAG column is read and written in chunks of rows, one data
+    description (spectral window) at a time, so windows with different
+    numbers of channels each get their own edge mask. Channel counts and
+    scan start times come from the metadata index.
+
+    Parameters
+    ----------
+        vis: str
+            measurement set
+        edgefraction: float
+            see edge_channel_mask (default: 0.1)
+        quackinterval: float
+            time [s] flagged at the start of each scan (default: 5)
+        chunksize: int
+            number of rows per read/write (default: None, about
+            metadata.chunk_bytes of FLAG per chunk)
+
+    Returns
+    -------
+        float: fraction of visibilities flagged after the pass
+    """
+    from casatools import table
+
+    index = _md.get_index(vis)
+    nchan = _md.nchan(index)
+    scan_start = _md.scan_starts(index)
+    chunksize = chunksize or _md.chunk_rows(max(nchan, default=1), 1)
+
+    tb = table()
+    tb.open(vis, nomodify=False)
+
+    nflagged, ntotal = 0, 0
+    for ddid, spw in enumerate(index["datadesc_spw"]):
+        edges = edge_channel_mask(nchan[spw], edgefraction)
+        sub = tb.query(f"DATA_DESC_ID=={ddid}")
+        for startrow in range(0, sub.nrows(), chunksize):
+            nrow = min(chunksize, sub.nrows() - startrow)
+            get = lambda col: sub.getcol(col, startrow=startrow, nrow=nrow)
+            # FLAG is (ncorr, nchan, nrow)
+            flag = get("FLAG")
+            scan = get("SCAN_NUMBER")
+            start = np.vectorize(scan_start.get, otypes=[float])(scan)
+            rows = get("ANTENNA1") == get("ANTENNA2")
+            rows |= get("TIME") < start + quackinterval
+            flag[:, edges, :] = True
+            flag[:, :, rows] = True
+            sub.putcol("FLAG", flag, startrow=startrow, nrow=nrow)
+            flag_row = flag.all(axis=(0, 1))
+            sub.putcol("FLAG_ROW", flag_row, startrow=startrow, nrow=nrow)
+            nflagged += flag.sum()
+            ntotal += flag.size
+        sub.close()
+    tb.close()
+
+    fraction = nflagged / ntotal if ntotal > 0 else 0.0
+    print(f"{100 * fraction:.1f}% of the visibilities are flagged")
+    return fraction
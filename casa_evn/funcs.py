@@ -1,28 +1,138 @@
 import os
-from astropy.io import fits as pyfits
-from casavlbitools import fitsidi
-from casatasks import applycal, flagdata, flagmanager, gencal, importfitsidi, listobs
-from casaplotms import plotms
-from casatools import msmetadata as msmd
+import json
+import gzip
+import time
+import shutil
 import glob
+from . import instrument as _i
+from . import flagging as _fl
+from . import idi as _idi
+from . import validation as _val
+from . import diagnostics as _diag
+from . import caltables as _ct
+from . import sweep as _sw
+from . import export as _ex
+from . import metadata as _md
+from . import selection as _sel
+from . import pipeline as _p
+
+# CASA is imported on the first call of each task, see instrument.lazy_task
+(
+    applycal,
+    bandpass,
+    concat,
+    flagdata,
+    flagmanager,
+    fringefit,
+    gencal,
+    importfitsidi,
+    listobs,
+    mstransform,
+    partition,
+) = (
+    _i.traced(_i.lazy_task("casatasks", name))
+    for name in (
+        "applycal",
+        "bandpass",
+        "concat",
+        "flagdata",
+        "flagmanager",
+        "fringefit",
+        "gencal",
+        "importfitsidi",
+        "listobs",
+        "mstransform",
+        "partition",
+    )
+)
+plotms = _i.lazy_task("casaplotms", "plotms")
 
 
 # General
-def gunzip(basedir, calibdir, keep=False):
+gunzip_bufsize = 4 * 1024**2
+
+
+def _gunzip_file(gzfile, keep=False, bufsize=gunzip_bufsize):
+    """Decompress a single gz file next to itself
+
+    Decompression streams through a fixed-size buffer and gzip checks the
+    CRC and length of the output at the end of the stream.
+
+    Returns
+    -------
+        gzfile, status, nbytes, elapsed: str, str, int, float
+    """
+    outfile = gzfile[: -len(".gz")]
+    if os.path.isfile(outfile) and os.path.getmtime(outfile) >= os.path.getmtime(
+        gzfile
+    ):
+        return gzfile, "skipped", 0, 0.0
+
+    start = time.perf_counter()
+    partfile = f"{outfile}.part"
+    try:
+        with gzip.open(gzfile, "rb") as fin, open(partfile, "wb") as fout:
+            shutil.copyfileobj(fin, fout, bufsize)
+    except (OSError, EOFError) as e:
+        if os.path.isfile(partfile):
+            os.remove(partfile)
+        return gzfile, f"failed ({e})", 0, 0.0
+    os.replace(partfile, outfile)
+    if not keep:
+        os.remove(gzfile)
+    return gzfile, "decompressed", os.path.getsize(outfile), time.perf_counter() - start
+
+
+def gunzip(basedir, calibdir, keep=False, max_workers=1):
+    """Decompress all gz files of a directory
+
+    Parameters
+    ----------
+        basedir, calibdir
+        keep: bool
+            Keep the gz files (default: False)
+        max_workers: int
+            Number of worker processes (default: 1, i.e. serial)
+    """
     search_gz = f"{basedir}/{calibdir}"
-    for f in os.listdir(search_gz):
-        if ".gz" in f:
-            cmd = f"gunzip {search_gz}/{f}" if (not keep) else f"gunzip {f} -k"
-            print(cmd)
-            os.system(cmd)
+    gzfiles = sorted(
+        f"{search_gz}/{f}" for f in os.listdir(search_gz) if f.endswith(".gz")
+    )
+
+    start = time.perf_counter()
+    if max_workers is None or max_workers > 1:
+        with _i.process_pool(max_workers) as pool:
+            results = list(pool.map(_gunzip_file, gzfiles, [keep] * len(gzfiles)))
+    else:
+        results = [_gunzip_file(f, keep=keep) for f in gzfiles]
+    elapsed = time.perf_counter() - start
+
+    failed = []
+    for gzfile, status, nbytes, t in results:
+        rate = f", {nbytes / 1024**2 / t:.1f} MB/s" if t > 0 else ""
+        print(f"{os.path.basename(gzfile)}: {status}{rate}")
+        if status.startswith("failed"):
+            failed.append(gzfile)
+
+    total = sum(r[2] for r in results)
+    if total > 0:
+        print(
+            f"Decompressed {total / 1024**2:.1f} MB in {elapsed:.1f} s "
+            f"({total / 1024**2 / elapsed:.1f} MB/s)"
+        )
+    if failed:
+        print("🛑 Some files could not be decompressed, they may be corrupted")
+        raise RuntimeError(f"gunzip failed for {', '.join(failed)}")
 
 
 def gen_list_of_scans(basedir, calibdir, experiment, vis):
+    """Write the listobs of vis, replacing any earlier one
+
+    The pipeline only runs the step when vis changed (e.g. after an
+    incremental import), so an existing file is stale.
+    """
     listobsfile = f"{basedir}/{calibdir}/{experiment}.listobs"
-    if os.path.isfile(listobsfile) == False:
-        listobs(vis, listfile=listobsfile)
-    else:
-        print("✅ A file with listobs information is already present")
+    listobs(vis, listfile=listobsfile, overwrite=True)
 
 
 def get_idifiles(basedir, fitsdir, experiment):
@@ -57,35 +167,142 @@ def set_working_vars(basedir, workdir, experiment):
     return (gcaltab, tsystab, sbdtab, mbdtab, bpasstab)
 
 
-def append_tsys_gaincurve(basedir, calibdir, experiment, idifiles):
+def validate(basedir, calibdir, workdir, experiment, vis, idifiles, gcfile):
+    """Check the inputs against each other before any heavy step
+
+    See validation.validate; gcfile is the gain curve file gen_cal uses.
+    The report is written to {experiment}.validation.json in the working
+    directory and a RuntimeError is raised if any check fails.
+    """
+    calib = f"{basedir}/{calibdir}/{experiment}"
+    work = f"{basedir}/{workdir}"
+    return _val.validate(
+        f"{calib}.antab",
+        f"{calib}.uvflg",
+        gcfile,
+        idifiles,
+        vis,
+        reportfile=f"{work}/{experiment}.validation.json",
+    )
+
+
+def inspect_idifiles(basedir, workdir, experiment, idifiles, verbose=True):
+    """Summarise the FITS-IDI files from their headers (see idi.inspect)
+
+    Summaries are cached in {experiment}.idi_headers.json in the working
+    directory.
+    """
+    cache = f"{basedir}/{workdir}/{experiment}.idi_headers.json"
+    infos = _idi.inspect(idifiles, cache=cache)
+    if verbose:
+        _idi.summary(infos)
+    return infos
+
+
+def _append_tsys_single(antabfile, idifile):
+    """Append the TSYS table of antabfile to a single FITS-IDI file
+
+    Returns
+    -------
+        idifile, appended: str, bool
+            appended is False when the table was already present
+    """
+    from casavlbitools import fitsidi
+
+    if _idi.has_extension(idifile, "SYSTEM_TEMPERATURE"):
+        return idifile, False
+    fitsidi.append_tsys(antabfile, [idifile])
+    return idifile, True
+
+
+def append_tsys(antabfile, idifiles, max_workers=1):
+    """Append TSYS to every FITS-IDI file missing a SYSTEM_TEMPERATURE table
+
+    Each file is handled independently, so files already carrying the
+    table are skipped and the others can be written by separate workers.
+
+    Parameters
+    ----------
+        antabfile: str
+            ANTAB file
+        idifiles: list
+            FITS-IDI files
+        max_workers: int
+            Number of worker processes (default: 1, i.e. serial)
+    """
+    n = len(idifiles)
+    if max_workers is None or max_workers > 1:
+        from concurrent.futures import as_completed
+
+        with _i.process_pool(max_workers) as pool:
+            futures = [
+                pool.submit(_append_tsys_single, antabfile, idifile)
+                for idifile in idifiles
+            ]
+            results = (future.result() for future in as_completed(futures))
+            for i, (idifile, appended) in enumerate(results, start=1):
+                state = "appended" if appended else "already present"
+                print(f"[{i}/{n}] TSYS {state}: {os.path.basename(idifile)}")
+    else:
+        for i, idifile in enumerate(idifiles, start=1):
+            idifile, appended = _append_tsys_single(antabfile, idifile)
+            state = "appended" if appended else "already present"
+            print(f"[{i}/{n}] TSYS {state}: {os.path.basename(idifile)}")
+
+
+def append_tsys_gaincurve(basedir, calibdir, experiment, idifiles, max_workers=1):
+    from casavlbitools import fitsidi
+
     antabfile = f"{basedir}/{calibdir}/{experiment}.antab"
-    try:
-        hdulist = pyfits.open(idifiles[0])
-        hdu = hdulist["SYSTEM_TEMPERATURE"]
-        print("✅ TSYS table already present, skipping the append step")
-    except IndexError:
+    if len(idifiles) == 0:
         print("🛑 Your list of files is empty, have you set the correct path?")
-    except KeyError:
-        print("Appending TSYS, this takes some time, go for a walk")
-        fitsidi.append_tsys(antabfile, idifiles)
+        return
+
+    try:
+        print("Appending TSYS where missing")
+        append_tsys(antabfile, idifiles, max_workers=max_workers)
     except FileNotFoundError:
         print("🛑 Your FITS-IDI files cannot be found, have you set the correct path?")
 
     try:
-        hdulist = pyfits.open(idifiles[0])
-        hdu = hdulist["GAIN_CURVE"]
-        print("✅ Gain curve table already present, skipping the append step")
-    except KeyError:
-        print("Appending gain curve")
-        fitsidi.append_gc(antabfile, idifiles[0])
-    except IndexError:
-        print("🛑 Your list of files is empty, have you set the correct path?")
+        if _idi.has_extension(idifiles[0], "GAIN_CURVE"):
+            print("✅ Gain curve table already present, skipping the append step")
+        else:
+            print("Appending gain curve")
+            fitsidi.append_gc(antabfile, idifiles[0])
     except FileNotFoundError:
         print("🛑 Your FITS-IDI files cannot be found, have you set the correct path?")
 
 
-def import_fits_idi(basedir, fitsdir, workdir, experiment, vis, idifiles):
-    #
+idi_manifest = lambda vis: f"{vis}.idi.json"
+
+
+def _idi_entries(idifiles, previous=()):
+    """Path, size, mtime and checksum of FITS-IDI files
+
+    The checksum of a file whose size and mtime match its previous entry
+    is not computed again.
+    """
+    previous = {e["path"]: e for e in previous}
+    entries = []
+    for path in idifiles:
+        st = os.stat(path)
+        entry = {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        old = previous.get(path, {})
+        if all(old.get(k) == entry[k] for k in ("size", "mtime_ns")):
+            entry["checksum"] = old["checksum"]
+        else:
+            entry["checksum"] = _p.fingerprint(path)
+        entries.append(entry)
+    return entries
+
+
+def _remove(pattern):
+    for path in glob.glob(pattern):
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+
+def _importfitsidi(idifiles, vis):
     importfitsidi(
         fitsidifile=idifiles,
         vis=vis,
@@ -95,11 +312,146 @@ def import_fits_idi(basedir, fitsdir, workdir, experiment, vis, idifiles):
     )
 
 
+def import_fits_idi(
+    basedir, fitsdir, workdir, experiment, vis, idifiles, incremental=False, replay=()
+):
+    """Import FITS-IDI files into vis
+
+    The imported files are recorded in {vis}.idi.json. In incremental mode,
+    files not in that record are imported into a side MS, which replay is
+    applied to before it is appended to vis; the whole list is imported
+    again if a recorded file was removed or its checksum changed. A full
+    import replaces vis, its flag versions and its records.
+
+    Parameters
+    ----------
+        basedir, fitsdir, workdir, experiment, vis, idifiles
+        incremental: bool
+            Append the new files to an existing vis (default: False)
+        replay: list
+            callables taking an MS, reproducing on the new data the flagging
+            and calibration already applied to vis
+
+    Returns
+    -------
+        list: files appended to an existing vis ([] for a full import)
+    """
+    manifest = idi_manifest(vis)
+    previous = []
+    if incremental and os.path.isdir(vis) and os.path.isfile(manifest):
+        with open(manifest) as f:
+            previous = json.load(f)
+    entries = _idi_entries(idifiles, previous)
+
+    current = {e["path"]: e["checksum"] for e in entries}
+    changed = [e["path"] for e in previous if current.get(e["path"]) != e["checksum"]]
+    known = {e["path"] for e in previous}
+    new = [p for p in idifiles if p not in known]
+    if changed:
+        print(f"🛑 {len(changed)} FITS-IDI files changed or removed, importing all")
+    if previous and not changed and not new:
+        print("✅ All FITS-IDI files are already imported")
+        return []
+
+    if previous and not changed:
+        print(f"Appending {len(new)} new FITS-IDI files to {vis}")
+        side = f"{vis}.new"
+        _remove(f"{side}*")
+        _importfitsidi(new, side)
+        for func in replay:
+            func(side)
+        concat(vis=[side], concatvis=vis)
+        _remove(f"{side}*")
+    else:
+        # importfitsidi does not replace an existing MS
+        for path in (vis, f"{vis}.flagversions", manifest, _md.index_file(vis)):
+            _remove(path)
+        _importfitsidi(idifiles, vis)
+        new = []
+
+    with open(manifest, "w") as f:
+        json.dump(entries, f, indent=1)
+    _md.get_index(vis, rebuild=True)
+    return new
+
+
+def mpi_servers():
+    """Number of MPI servers available to CASA (0 when not run with mpicasa)"""
+    try:
+        from casampi.MPIEnvironment import MPIEnvironment
+    except ImportError:
+        return 0
+    if not MPIEnvironment.is_mpi_enabled:
+        return 0
+    return MPIEnvironment.mpi_world_size - 1
+
+
+def partition_ms(vis, mms, separationaxis="scan", numsubms="auto"):
+    """Partition an MS into a multi-MS
+
+    applycal, flagdata and gencal then process the sub-MSs in parallel on
+    the MPI servers when CASA is started with mpicasa (see init_casa.sh).
+
+    Parameters
+    ----------
+        vis: str
+        mms: str
+            output multi-MS, replaced if it exists
+        separationaxis: str
+            'scan', 'spw', 'baseline' or 'auto' (default: 'scan')
+        numsubms: int or str
+            number of sub-MSs (default: 'auto', one per MPI server)
+    """
+    nservers = mpi_servers()
+    if nservers == 0:
+        print("🛑 CASA is not running under mpicasa, the MMS is processed serially")
+    if os.path.isdir(mms):
+        shutil.rmtree(mms)
+    partition(
+        vis=vis,
+        outputvis=mms,
+        separationaxis=separationaxis,
+        numsubms=numsubms,
+        flagbackup=False,
+    )
+    _md.get_index(mms, rebuild=True)
+
+
+def merge_mms(mms, vis):
+    """Merge a multi-MS back into a single MS, replacing vis
+
+    All data columns are kept, so the calibrated data carry over. The merged
+    MS is written next to vis and only replaces it once complete.
+    """
+    tmp = f"{vis}.tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    mstransform(vis=mms, outputvis=tmp, datacolumn="all", createmms=False)
+    if os.path.isdir(vis):
+        shutil.rmtree(vis)
+    os.replace(tmp, vis)
+    _md.get_index(vis, rebuild=True)
+
+
 # Data reduction & calibration
-def convert_flag(basedir, calibdir, workdir, experiment, idifiles):
+def convert_flag(basedir, calibdir, workdir, experiment, idifiles, merge=True):
+    """Convert the AIPS UVFLG file to a flagdata command list
+
+    Parameters
+    ----------
+        basedir, calibdir, workdir, experiment, idifiles
+        merge: bool
+            Merge overlapping time ranges into a minimal command list
+            (default), or convert entry by entry with casavlbitools
+    """
+    from casavlbitools import fitsidi
+
     AIPSflag = f"{basedir}/{calibdir}/{experiment}.uvflg"
     outfile = f"{basedir}/{workdir}/{experiment}.flag"
-    fitsidi.convert_flags(AIPSflag, idifiles, outfile=outfile)
+    if merge:
+        _fl.convert_uvflg(AIPSflag, idifiles, outfile)
+    else:
+        fitsidi.convert_flags(AIPSflag, idifiles, outfile=outfile)
 
 
 def flag_data(basedir, workdir, experiment, vis):
@@ -115,35 +467,266 @@ def flag_data(basedir, workdir, experiment, vis):
     )
 
 
-def gen_cal(vis, tsystab, gcaltab):
-    gencal(vis, caltable=tsystab, caltype="tsys", uniform=False)
-    gencal(vis, caltable=gcaltab, caltype="gc", infile="EVN.gc")
+def gen_cal(vis, tsystab, gcaltab, gcfile="EVN.gc", reuse=True, aliases=None):
+    """Generate the TSYS and gain curve tables
+
+    With reuse, the tables go through the calibration table store (see
+    caltables.solve, aliases) and are only generated again when the MS
+    metadata, its SYSCAL table or the gain curve file changed.
+    """
+    metadata = [f"{vis}/{sub}" for sub in _md.subtables]
+    tsys = lambda table: gencal(vis, caltable=table, caltype="tsys", uniform=False)
+    gc = lambda table: gencal(vis, caltable=table, caltype="gc", infile=gcfile)
+    if not reuse:
+        tsys(tsystab)
+        gc(gcaltab)
+        return
+    _ct.solve(
+        tsystab,
+        tsys,
+        "gencal",
+        {"caltype": "tsys", "uniform": False},
+        metadata + [f"{vis}/SYSCAL"],
+        aliases=aliases,
+    )
+    _ct.solve(
+        gcaltab,
+        gc,
+        "gencal",
+        {"caltype": "gc"},
+        metadata + [gcfile],
+        aliases=aliases,
+    )
 
 
 def apply_cal(vis, tsystab, gcaltab):
     applycal(vis=vis, gaintable=[tsystab, gcaltab], flagbackup=False, parang=True)
 
 
-def flag_autocorrelation(vis):
-    print("To flag autocorrelation:")
-    msmd.open(vis)
-    nspw = msmd.nspw()
-    nchan = msmd.nchan(1)
-    msmd.done()
+# Interpolation of each kind of table when applied
+chain_interp = {
+    "gcal": "nearest",
+    "tsys": "nearest,nearest",
+    "sbd": "nearest",
+    "mbd": "linear",
+    "bpass": "linear,linear",
+}
 
-    flagdata(vis, mode="manual", autocorr=True, flagbackup=False)
-    myflags = None
-    edgefraction = 0.1
-    flagfraction = int(nchan / (100 * edgefraction))
-    start = str(flagfraction - 1)
-    end = str(nchan - flagfraction)
-    spwflag = "*:0~" + start + ";" + end + "~" + str(nchan - 1)
 
-    # return nspw, myflags, spwflag
+def gain_chain(vis, tables):
+    """gaintable, interp and spwmap of a chain of calibration tables
 
+    Parameters
+    ----------
+        vis: str
+        tables: list
+            (kind, path) pairs, kind a key of chain_interp
+
+    Returns
+    -------
+        dict: gaintable, interp, spwmap; the multi-band delay table,
+        solved with combine='spw', is mapped from spw 0 to all the spectral
+        windows of the MS
+    """
+    nspw = len(_md.get_index(vis)["spws"])
+    return {
+        "gaintable": [path for _, path in tables],
+        "interp": [chain_interp[kind] for kind, _ in tables],
+        "spwmap": [nspw * [0] if kind == "mbd" else [] for kind, _ in tables],
+    }
+
+
+def _solve(task, name, vis, caltable, chain, aliases=None, flagstamp=None, **params):
+    """Run a solving task through the calibration table store
+
+    The table is keyed on the metadata subtables of vis, its flags and the
+    upstream tables, not on the whole MS, which applycal and flagdata
+    rewrite after each solve. flagstamp identifies the flags, e.g. the
+    pipeline stamp of the step that last changed them (default: the
+    fingerprint of vis).
+    """
+    flagstamp = flagstamp or _p.fingerprint(vis)
+    _ct.solve(
+        caltable,
+        lambda table: task(vis=vis, caltable=table, **chain, **params),
+        name,
+        {
+            **params,
+            "interp": chain["interp"],
+            "spwmap": chain["spwmap"],
+            "flags": flagstamp,
+        },
+        [f"{vis}/{sub}" for sub in _md.subtables] + chain["gaintable"],
+        aliases=aliases,
+    )
 
-def flagquack_intervals(vis):
-    flagdata(vis, mode="quack", quackinterval=5, flagbackup=False)
+
+def fringe_sbd(
+    vis,
+    sbdtab,
+    chain,
+    refant,
+    scanfile,
+    minsnr=50,
+    duration=120.0,
+    aliases=None,
+    flagstamp=None,
+):
+    """Single-band delay on the best fringe finder scan
+
+    The scan and time range are picked from the data (see
+    find_sbd_timerange) and written to scanfile, with refant, for the later
+    steps. aliases and flagstamp key the table in the store, see _solve.
+    """
+    best = _sel.find_fringe_scan(vis, refant.split(",")[0], duration=duration)
+    if best is None:
+        raise RuntimeError(f"No fringe finder scan found with baselines to {refant}")
+    with open(scanfile, "w") as f:
+        json.dump(
+            {**{k: best[k] for k in ("scan", "field", "timerange")}, "refant": refant},
+            f,
+        )
+    _solve(
+        fringefit,
+        "fringefit",
+        vis,
+        sbdtab,
+        chain,
+        timerange=best["timerange"],
+        solint="inf",
+        zerorates=True,
+        refant=refant,
+        minsnr=minsnr,
+        corrdepflags=False,
+        parang=True,
+        aliases=aliases,
+        flagstamp=flagstamp,
+    )
+
+
+def fringe_scan(scanfile):
+    """Fringe finder scan written by fringe_sbd, {} if none"""
+    if not os.path.isfile(scanfile):
+        return {}
+    with open(scanfile) as f:
+        return json.load(f)
+
+
+def fringe_finder(scanfile):
+    """Field of the fringe finder scan written by fringe_sbd, None if none"""
+    return fringe_scan(scanfile).get("field")
+
+
+def fringe_mbd(
+    vis,
+    mbdtab,
+    chain,
+    refant,
+    fields=None,
+    minsnr=5,
+    scanfile=None,
+    aliases=None,
+    flagstamp=None,
+):
+    """Multi-band delay and rate on the calibrators, combining the spws
+
+    By default the fields observed with calibration intents only or, if the
+    MS has no intents (e.g. imported from FITS-IDI), the fringe finder of
+    the single-band delay recorded in scanfile. aliases and flagstamp key
+    the table in the store, see _solve.
+    """
+    if not fields:
+        fields = _md.calibrator_fields(_md.get_index(vis))
+    if not fields:
+        fields = [fringe_finder(scanfile)]
+        if fields == [None]:
+            raise RuntimeError(f"No calibration intents in {vis} nor {scanfile}")
+        print(
+            f"⚠️  No calibration intents in {vis}, solving the multi-band delay "
+            f"on the fringe finder {fields[0]} only; give the calibrators with "
+            "-b/--calibrators"
+        )
+    _solve(
+        fringefit,
+        "fringefit",
+        vis,
+        mbdtab,
+        chain,
+        field=",".join(fields),
+        solint="inf",
+        zerorates=False,
+        refant=refant,
+        combine="spw",
+        minsnr=minsnr,
+        corrdepflags=True,
+        parang=True,
+        aliases=aliases,
+        flagstamp=flagstamp,
+    )
+
+
+def bandpass_cal(
+    vis,
+    bpasstab,
+    chain,
+    refant,
+    field=None,
+    scanfile=None,
+    aliases=None,
+    flagstamp=None,
+):
+    """Bandpass on field, by default the fringe finder of the sbd
+
+    aliases and flagstamp key the table in the store, see _solve.
+    """
+    if field is None:
+        with open(scanfile) as f:
+            field = json.load(f)["field"]
+    _solve(
+        bandpass,
+        "bandpass",
+        vis,
+        bpasstab,
+        chain,
+        field=field,
+        solnorm=True,
+        solint="inf",
+        refant=refant,
+        bandtype="B",
+        parang=True,
+        aliases=aliases,
+        flagstamp=flagstamp,
+    )
+
+
+def apply_final(vis, chain):
+    """Apply the whole calibration chain to the corrected data"""
+    applycal(vis=vis, **chain, flagbackup=False, parang=True)
+
+
+def flag_autocorrelation(vis, edgefraction=0.1, quackinterval=5.0):
+    """Flag autocorrelations, edge channels of every spw and scan starts
+
+    All three are applied in a single pass over the FLAG column, see
+    flagging.flag_autocorr_edges_quack.
+    """
+    _fl.flag_autocorr_edges_quack(
+        vis, edgefraction=edgefraction, quackinterval=quackinterval
+    )
+
+
+def flagquack_intervals(vis, quack=True):
+    """Flag quack intervals and save the pre-calibration flags
+
+    Parameters
+    ----------
+        vis: str
+        quack: bool
+            Run flagdata in quack mode; not needed after flag_autocorrelation,
+            which already flags the scan starts (default: True)
+    """
+    if quack:
+        flagdata(vis, mode="quack", quackinterval=5, flagbackup=False)
     flagmanager(
         vis,
         mode="save",
@@ -152,11 +735,148 @@ def flagquack_intervals(vis):
     )
 
 
+def prune_flag_versions(vis, keep=("precal_flags",)):
+    """Delete the flag versions of vis not in keep
+
+    The backups saved by the tasks run with flagbackup=True (flagdata_1,
+    ...) are intermediate; precal_flags, saved by flagquack_intervals, is
+    kept to restore the flags before calibration.
+
+    Returns
+    -------
+        list: deleted version names
+    """
+    listfile = f"{vis}.flagversions/FLAG_VERSION_LIST"
+    if not os.path.isfile(listfile):
+        return []
+    with open(listfile) as f:
+        versions = [line.split(" : ")[0].strip() for line in f if line.strip()]
+    deleted = [v for v in versions if v not in keep]
+    for version in deleted:
+        flagmanager(vis, mode="delete", versionname=version)
+    if deleted:
+        print(f"✅ Deleted flag versions {', '.join(deleted)} of {vis}")
+    return deleted
+
+
+def find_sbd_timerange(vis, refant, fields=None, duration=120.0):
+    """Time range on the best fringe finder scan for the single-band delay
+
+    Replaces the manual search by plotting time vs amp:corrected, see
+    selection.find_fringe_scan.
+    """
+    best = _sel.find_fringe_scan(vis, refant, fields=fields, duration=duration)
+    return best["timerange"] if best is not None else None
+
+
+def select_refant(vis, nrefant=3):
+    """Best reference antennas from the data, as a fringefit refant list
+
+    See selection.rank_refants; antennas without any unflagged data are
+    never selected.
+    """
+    ranked, stats = _sel.rank_refants(vis)
+    refants = [a for a in ranked if stats[a]["score"] > 0][:nrefant]
+    print(f"✅ Reference antennas: {','.join(refants)}")
+    return ",".join(refants)
+
+
+def sweep_sbd(
+    vis, refant, gaintables, outdir, grid, timerange=None, field="", max_workers=2
+):
+    """Single-band delay fringefit over a grid of parameter sets
+
+    The defaults are those of fringe_sbd, the grid (e.g. minsnr, solint,
+    combine, refant) overrides them; see
+    sweep.sweep_fringefit. The trials are reported, best first, in
+    {outdir}/sweep.json.
+    """
+    base = dict(
+        timerange=timerange or "",
+        field=field,
+        solint="inf",
+        zerorates=True,
+        refant=refant,
+        minsnr=50,
+        gaintable=gaintables,
+        corrdepflags=False,
+        interp=["nearest"] + ["nearest,nearest"] * (len(gaintables) - 1),
+        parang=True,
+    )
+    return _sw.sweep_fringefit(
+        vis,
+        grid,
+        base,
+        outdir,
+        max_workers=max_workers,
+        report=f"{outdir}/sweep.json",
+    )
+
+
+def export_products(
+    vis,
+    outdir,
+    experiment,
+    fields=None,
+    exclude=(),
+    timebin="0s",
+    width=1,
+    max_workers=2,
+):
+    """Per-source calibrated MS and UVFITS files, see export.export_products
+
+    Replaces split_data and store_data of reduction.py; products are
+    {outdir}/{experiment}_{field}.ms and .uvfits.
+    """
+    return _ex.export_products(
+        vis,
+        outdir,
+        experiment,
+        fields=fields,
+        exclude=exclude,
+        timebin=timebin,
+        width=width,
+        max_workers=max_workers,
+    )
+
+
 basedir_subdir_experiment = lambda base, sub, experiment: f"{base}/{sub}/{experiment}"
 
 
 # Quick plot
+def diagnostic_plots(
+    vis, refant, outdir, fields=None, gaintables=(), max_workers=4, aliases=None
+):
+    """Headless counterpart of the plotms_* helpers, for all baselines
+
+    Phase and amplitude against frequency and time of every baseline to
+    refant are written per field as PNG files to outdir, with an
+    index.html, see diagnostics.plot_baselines. The averaged visibilities
+    are cached per state of the MS and of the applied gaintables, see
+    diagnostics.cache_key for aliases.
+    """
+    refant = refant.split(",")[0]
+    return _diag.plot_baselines(
+        vis,
+        refant,
+        outdir,
+        fields=fields,
+        gaintables=gaintables,
+        max_workers=max_workers,
+        aliases=aliases,
+    )
+
+
+def _check_plot_selection(vis, ref, field):
+    index = _md.get_index(vis)
+    if ref not in index["antennas"]:
+        print(f"🛑 {ref} is not in {', '.join(index['antennas'])}")
+    elif len(_md.scans_for_field(index, field)) == 0:
+        print(f"🛑 No scans on field {field}")
+
+
 def plotms_phase_freq(vis, ref="EF", field="0", avgtime="600"):
+    _check_plot_selection(vis, ref, field)
     plotms(
         vis=vis,
         xaxis="frequency",
@@ -175,6 +895,7 @@ def plotms_phase_freq(vis, ref="EF", field="0", avgtime="600"):
 
 
 def plotms_freq_amplitude(vis, ref="EF", field="0", avgtime="600"):
+    _check_plot_selection(vis, ref, field)
     plotms(
         vis=vis,
         xaxis="frequency",
@@ -193,6 +914,7 @@ def plotms_freq_amplitude(vis, ref="EF", field="0", avgtime="600"):
 
 
 def plotms_time_phase(vis, ref="EF", field="0", avgchannel="64"):
+    _check_plot_selection(vis, ref, field)
     plotms(
         vis=vis,
         xaxis="time",
@@ -212,6 +934,7 @@ def plotms_time_phase(vis, ref="EF", field="0", avgchannel="64"):
 
 
 def plotms_time_amplitude(vis, ref="EF", field="0", avgchannel="64"):
+    _check_plot_selection(vis, ref, field)
     plotms(
         vis=vis,
         xaxis="time",
@@ -230,62 +953,6 @@ def plotms_time_amplitude(vis, ref="EF", field="0", avgchannel="64"):
     )
 
 
-# # *****
-# # Fringe fitting
-# refant='EF'
-# sbdtimer='10:52:30~10:54:30' # found by plotting time vs amp:corrected for field2, EF, (ll,rr), 128 chan, all spectral windows
-# fringefit(vis, caltable=sbdtab, timerange=sbdtimer,
-#         solint='inf', zerorates=True, refant=refant,minsnr=50,
-#         gaintable=[gcaltab,tsystab], corrdepflags=False,
-#         interp=['nearest','nearest,nearest'],
-#         parang=True)
-
-
-# applycal(vis=vis,gaintable=[tsystab,gcaltab,sbdtab], flagbackup=False, parang=True)
-
-
-# # Multi-band delay
-# mbdfield='0,2'
-# refant='EF,O8'
-# fringefit(vis, caltable=mbdtab, field=mbdfield,
-#         solint='inf', zerorates=False, refant=refant,
-#         combine='spw', minsnr=5, corrdepflags=True,
-#         gaintable=[gcaltab, tsystab, sbdtab],
-#         parang=True)
-
-
-# # Apply calibration
-# # nspw=8
-# applycal(vis,
-#     gaintable=[gcaltab, tsystab, sbdtab, mbdtab],
-#     interp=['nearest','nearest,nearest','nearest','linear'],
-#     spwmap=[[], [], [], int(nspw)*[0]],
-#     parang=True)
-
-
-# # applycal(vis,
-# #     gaintable=[gcaltab, tsystab, sbdtab],
-# #     interp=['nearest','nearest,nearest','nearest'],
-# #     spwmap=[[], [], []],
-# #     parang=True)
-
-
-# # Bandpass
-# bpassfield='2'
-# bandpass(vis, caltable=bpasstab, field=bpassfield,
-#         gaintable=[gcaltab, tsystab, sbdtab, mbdtab],
-#         interp=['nearest','nearest,nearest','nearest','linear'],
-#         spwmap=[[],[],[], int(nspw)*[0]],
-#         solnorm=True, solint='inf', refant=refant,
-#         bandtype='B', parang=True)
-
-# applycal(vis,
-#     gaintable=[gcaltab, tsystab, sbdtab, mbdtab, bpasstab],
-#     interp=['nearest','nearest,nearest','nearest','linear','linear,linear'],
-#     spwmap=[[], [], [], int(nspw)*[0],[]],
-#     parang=True)
-# # ***
-
 # def polarization_calibration(basedir, workdir, experiment):
 #     print(f"""tget tclean
 #     basename = basedir_subdir_experiment(basedir, workdir, experiment)
@@ -0,0 +1,166 @@
+import os
+import json
+import numpy as np
+from . import metadata as _md
+
+_memo = {}
+
+
+def _edge_rows(idifile, hdulist, extname, columns):
+    """Columns of the first and last rows of a binary table extension
+
+    Only those two rows are read, through a memory map of the table.
+    """
+    hdu = hdulist[extname]
+    nrows = hdu.header["NAXIS2"]
+    dtype = hdu.columns.dtype.newbyteorder(">")
+    if nrows == 0 or dtype.itemsize != hdu.header["NAXIS1"]:
+        return None
+    offset = hdulist.fileinfo(hdulist.index_of(extname))["datLoc"]
+    rows = np.memmap(idifile, dtype=dtype, mode="r", offset=offset, shape=(nrows,))
+    edges = rows[[0, -1]]
+    return {c: edges[c].astype(float) for c in columns}
+
+
+def read_idi(idifile):
+    """Summary of a FITS-IDI file from its extension headers
+
+    The file is opened lazily and memory-mapped: the small ANTENNA and
+    FREQUENCY tables are read, and only the first and last rows of
+    UV_DATA for the time span.
+
+    Returns
+    -------
+        dict: extensions (name -> number of rows), rdate, antennas (list of
+        [number, name]), nspw, nchan, nstokes, ref_freq, bandfreq,
+        chan_bw, start, end (MJD seconds)
+    """
+    from astropy.io import fits as pyfits
+
+    with pyfits.open(idifile, memmap=True, lazy_load_hdus=True) as hdulist:
+        info = {"extensions": {}}
+        for hdu in hdulist[1:]:
+            info["extensions"][hdu.name] = hdu.header.get("NAXIS2", 0)
+        if "ANTENNA" in info["extensions"]:
+            antenna = hdulist["ANTENNA"].data
+            info["antennas"] = [
+                [int(n), str(a).strip()]
+                for n, a in zip(antenna["ANTENNA_NO"], antenna["ANNAME"])
+            ]
+        if "UV_DATA" in info["extensions"]:
+            header = hdulist["UV_DATA"].header
+            info.update(
+                {
+                    "rdate": header.get("RDATE"),
+                    "nspw": header.get("NO_BAND"),
+                    "nchan": header.get("NO_CHAN"),
+                    "nstokes": header.get("NO_STKD"),
+                    "ref_freq": header.get("REF_FREQ"),
+                    "chan_bw": header.get("CHAN_BW"),
+                }
+            )
+            edges = _edge_rows(idifile, hdulist, "UV_DATA", ["DATE", "TIME"])
+            if edges is not None:
+                mjd = (edges["DATE"] - 2400000.5 + edges["TIME"]) * 86400.0
+                info["start"], info["end"] = float(mjd[0]), float(mjd[1])
+        if "FREQUENCY" in info["extensions"]:
+            bandfreq = np.atleast_1d(hdulist["FREQUENCY"].data["BANDFREQ"][0])
+            info["bandfreq"] = [float(f) for f in bandfreq]
+    return info
+
+
+def _stat_key(idifile):
+    st = os.stat(idifile)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def inspect(idifiles, cache=None, max_workers=8):
+    """Summaries of FITS-IDI files, read in parallel and cached
+
+    A summary is reused as long as the size and mtime of its file are
+    unchanged, from memory or from the cache file.
+
+    Parameters
+    ----------
+        idifiles: list
+        cache: str
+            JSON file the summaries are kept in (default: None, memory only)
+        max_workers: int
+            Number of threads reading headers (default: 8)
+
+    Returns
+    -------
+        dict: file -> summary (see read_idi) with its size and mtime_ns
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    cached = {}
+    if cache is not None and os.path.isfile(cache):
+        with open(cache) as f:
+            cached = json.load(f)
+    cached.update(_memo)
+
+    infos, stale = {}, []
+    for idifile in idifiles:
+        key = _stat_key(idifile)
+        info = cached.get(idifile, {})
+        if all(info.get(k) == v for k, v in key.items()):
+            infos[idifile] = info
+        else:
+            stale.append(idifile)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for idifile, info in zip(stale, pool.map(read_idi, stale)):
+            infos[idifile] = {**_stat_key(idifile), **info}
+
+    _memo.update(infos)
+    if cache is not None and stale:
+        cached.update(infos)
+        tmp = f"{cache}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cached, f, separators=(",", ":"))
+        os.replace(tmp, cache)
+    return {idifile: infos[idifile] for idifile in idifiles}
+
+
+def has_extension(idifile, extname):
+    """Whether a FITS-IDI file has an extension, from the cached summary"""
+    return extname in inspect([idifile])[idifile]["extensions"]
+
+
+def summary(infos):
+    """Print one line per FITS-IDI file: size, setup, time span and tables"""
+    fmt = "{:<24}{:>9}{:>5}{:>11}{:>10}  {:<41}{}"
+    print(fmt.format("file", "size[GB]", "ant", "spw x chan", "rows", "time", "tables"))
+    for idifile, info in infos.items():
+        tables = [
+            short
+            for short, ext in (("TSYS", "SYSTEM_TEMPERATURE"), ("GC", "GAIN_CURVE"))
+            if ext in info["extensions"]
+        ]
+        span = "-"
+        if "start" in info:
+            span = "~".join(_md.mjd_to_casa([info["start"], info["end"]]))
+        print(
+            fmt.format(
+                os.path.basename(idifile)[:23],
+                f"{info['size'] / 1024**3:.2f}",
+                len(info.get("antennas", [])),
+                f"{info.get('nspw')} x {info.get('nchan')}",
+                info["extensions"].get("UV_DATA", 0),
+                span,
+                ",".join(tables) or "-",
+            )
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise FITS-IDI files")
+    parser.add_argument("idifiles", nargs="+", type=str)
+    parser.add_argument("--cache", type=str, default=None, help="JSON cache file")
+    parser.add_argument("-j", "--max-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    summary(inspect(args.idifiles, cache=args.cache, max_workers=args.max_workers))
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import resource
+import threading
+import functools
+import importlib
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_current = threading.local()
+_tracefile = None
+records = []
+# Peak RSS [MB] seen so far by each traced block still running
+_active_peaks = {}
+# Seconds between two samples of the disk usage of a step
+disk_interval = 5.0
+# Called with no argument at the start of every worker process of
+# process_pool, e.g. to register stand-in modules (see benchmarks.standin)
+worker_init = None
+
+
+def set_trace_file(tracefile):
+    """Append trace records to tracefile (JSON lines), None to disable"""
+    global _tracefile
+    _tracefile = tracefile
+
+
+def path_size(path):
+    """Size in bytes of a file or directory (e.g. a measurement set)"""
+    if path is None or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+@contextmanager
+def disk_peak(paths, interval=None):
+    """Sample the total size of paths while the block runs
+
+    Yields a dict filled in with before, peak and after (bytes); the peak
+    misses what is written and removed between two samples.
+    """
+    size = lambda: sum(path_size(p) or 0 for p in paths)
+    usage = {"before": size()}
+    usage["peak"] = usage["before"]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval or disk_interval):
+            usage["peak"] = max(usage["peak"], size())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield usage
+    finally:
+        stop.set()
+        sampler.join()
+        usage["after"] = size()
+        usage["peak"] = max(usage["peak"], usage["after"])
+
+
+def _io_counters():
+    """Bytes read and written by this process so far
+
+    Uses /proc/self/io where available, block counts from getrusage otherwise.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        return int(io["read_bytes"]), int(io["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        return ru.ru_inblock * 512, ru.ru_oublock * 512
+
+
+def _cpu_time():
+    self_ = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_.ru_utime + self_.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _peak_rss_mb():
+    """Resident set size high-water mark of this process [MB]
+
+    VmHWM, which _reset_peak_rss resets, where available; ru_maxrss (the
+    peak since the process started, children included) otherwise.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    # ru_maxrss is in kB on Linux
+    self_ = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_, children) / 1024
+
+
+def _reset_peak_rss():
+    """Reset VmHWM to the current RSS, where the kernel allows it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _update_peaks(reset):
+    """Fold the high-water mark into the peaks of the running blocks
+
+    The mark is process-wide: it is read before each reset, so that a
+    block nested in or running alongside another one does not hide the
+    other's peak.
+    """
+    with _lock:
+        peak = _peak_rss_mb()
+        for key in _active_peaks:
+            _active_peaks[key] = max(_active_peaks[key], peak)
+        if reset:
+            _reset_peak_rss()
+        return peak
+
+
+def emit(record):
+    with _lock:
+        records.append(record)
+        if _tracefile is not None:
+            with open(_tracefile, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def trace(name, kind="step", vis=None):
+    """Record wall time, CPU time, peak RSS, I/O and MS size of a block
+
+    CPU time and I/O are process-wide counters (including finished child
+    processes), so they overlap when steps run concurrently. The peak RSS
+    is that of this process during the block, as far as /proc allows
+    resetting it (see _peak_rss_mb), so concurrent steps share theirs.
+
+    Parameters
+    ----------
+        name: str
+            step or task name
+        kind: str
+            'step' or 'task'
+        vis: str
+            measurement set whose size is recorded before and after
+    """
+    record = {
+        "name": name,
+        "kind": kind,
+        "step": name if kind == "step" else getattr(_current, "step", None),
+        "start": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "ms_bytes_before": path_size(vis),
+    }
+    if kind == "step":
+        _current.step = name
+    key = object()
+    _update_peaks(reset=True)
+    with _lock:
+        _active_peaks[key] = 0.0
+    read0, written0 = _io_counters()
+    cpu0 = _cpu_time()
+    wall0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield record
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        if kind == "step":
+            _current.step = None
+        read1, written1 = _io_counters()
+        _update_peaks(reset=False)
+        with _lock:
+            peak = _active_peaks.pop(key)
+        record.update(
+            {
+                "status": status,
+                "wall_s": round(time.perf_counter() - wall0, 3),
+                "cpu_s": round(_cpu_time() - cpu0, 3),
+                "peak_rss_mb": round(peak, 1),
+                "bytes_read": read1 - read0,
+                "bytes_written": written1 - written0,
+                "ms_bytes_after": path_size(vis),
+            }
+        )
+        emit(record)
+
+
+def traced(task):
+    """Wrap a CASA task so that each call is traced
+
+    The measurement set is taken from the vis argument (keyword or first
+    positional argument).
+    """
+    # casatasks are instances of task classes named after the task
+    name = getattr(task, "__name__", type(task).__name__.lstrip("_"))
+
+    @functools.wraps(task)
+    def wrapper(*args, **kwargs):
+        vis = kwargs.get("vis", args[0] if args else None)
+        vis = vis if isinstance(vis, str) else None
+        with trace(name, kind="task", vis=vis):
+            return task(*args, **kwargs)
+
+    return wrapper
+
+
+def lazy_task(module, name):
+    """A task of module, imported on its first call
+
+    casatasks and casaplotms take seconds to import; wrapping their tasks
+    keeps them out of the import of the pipeline modules, so that --help
+    or a dry run never loads CASA.
+    """
+
+    def task(*args, **kwargs):
+        return getattr(importlib.import_module(module), name)(*args, **kwargs)
+
+    task.__name__ = task.__qualname__ = name
+    return task
+
+
+def process_pool(max_workers):
+    """ProcessPoolExecutor of spawned workers, set up by worker_init
+
+    The workers are spawned, not forked: the pool is started from pipeline
+    threads of a process that may have loaded casatools or run under mpicasa.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=worker_init,
+    )
+
+
+def traced_step(name, func, vis=None, disk=None):
+    """Wrap a pipeline step callable so that it is traced
+
+    With disk, a list of directories, the size of the directories before,
+    after and at the peak of the step is recorded too (see disk_peak).
+    """
+
+    def wrapper():
+        with trace(name, kind="step", vis=vis) as record:
+            if not disk:
+                return func()
+            with disk_peak(disk) as usage:
+                result = func()
+            record.update({f"disk_bytes_{k}": v for k, v in usage.items()})
+            return result
+
+    return wrapper
+
+
+def summary(records=records):
+    """Print a table of traced steps, each followed by its CASA tasks"""
+    fmt = "{:<28}{:>9}{:>9}{:>9}{:>10}{:>10}{:>10}{:>10}  {}"
+    mb = lambda n: f"{n / 1024**2:.1f}" if n is not None else "-"
+    row = lambda r, name: fmt.format(
+        name,
+        f"{r['wall_s']:.1f}",
+        f"{r['cpu_s']:.1f}",
+        f"{r['peak_rss_mb']:.0f}",
+        mb(r["bytes_read"]),
+        mb(r["bytes_written"]),
+        mb(r["ms_bytes_after"]),
+        mb(r.get("disk_bytes_peak")),
+        "🛑 failed" if r["status"] == "failed" else "",
+    )
+
+    header = (
+        "name",
+        "wall[s]",
+        "cpu[s]",
+        "rss[MB]",
+        "read[MB]",
+        "wrtn[MB]",
+        "MS[MB]",
+        "disk[MB]",
+    )
+    print(fmt.format(*header, ""))
+    steps = [r for r in records if r["kind"] == "step"]
+    for s in steps:
+        print(row(s, s["name"]))
+        for r in records:
+            if r["kind"] == "task" and r["step"] == s["name"]:
+                print(row(r, f"  {r['name']}"))
+    step_names = {s["name"] for s in steps}
+    for r in records:
+        if r["kind"] == "task" and r["step"] not in step_names:
+            print(row(r, r["name"]))
@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+import numpy as np
+from . import pipeline as _p
+
+# Subtables describing the observation; flagging and calibration only
+# touch the main table, so these identify the metadata of an MS.
+subtables = [
+    "ANTENNA",
+    "DATA_DESCRIPTION",
+    "FIELD",
+    "OBSERVATION",
+    "POLARIZATION",
+    "SPECTRAL_WINDOW",
+    "STATE",
+]
+_memo = {}
+
+# Memory [bytes] the chunked passes over the MS hold at once, see chunk_rows
+chunk_bytes = 256 * 1024**2
+
+index_file = lambda vis: f"{vis}.meta.json"
+
+
+def ms_key(vis):
+    """Key identifying the metadata of a measurement set"""
+    h = hashlib.sha1()
+    for sub in subtables:
+        h.update(f"{sub}={_p.fingerprint(f'{vis}/{sub}')};".encode())
+    return h.hexdigest()
+
+
+def mjd_to_casa(seconds):
+    """MJD seconds to CASA time strings (YYYY/MM/DD/hh:mm:ss)"""
+    ms = np.round(np.asarray(seconds) * 1000).astype("timedelta64[ms]")
+    mjd0 = np.datetime64("1858-11-17", "ms")
+    iso = np.datetime_as_string(mjd0 + ms, unit="s")
+    return np.char.replace(np.char.replace(iso, "-", "/"), "T", "/")
+
+
+def build_index(vis):
+    """Collect antennas, spws, fields and scans of a measurement set
+
+    Returns
+    -------
+        dict
+    """
+    from casatools import msmetadata
+
+    md = msmetadata()
+    md.open(vis)
+    try:
+        index = {
+            "nrows": int(md.nrows()),
+            "antennas": [str(a) for a in md.antennanames()],
+            "spws": [
+                {
+                    "id": spw,
+                    "nchan": int(md.nchan(spw)),
+                    "meanfreq": float(md.meanfreq(spw)),
+                    "bandwidth": float(md.bandwidths(spw)),
+                }
+                for spw in range(md.nspw())
+            ],
+            "datadesc_spw": [
+                int(md.spwfordatadesc(dd)) for dd in md.datadescids()
+            ],
+            "fields": [str(f) for f in md.fieldnames()],
+            "scans": [],
+        }
+        for scan in md.scannumbers():
+            times = md.timesforscan(scan)
+            index["scans"].append(
+                {
+                    "scan": int(scan),
+                    "start": float(np.min(times)),
+                    "end": float(np.max(times)),
+                    "fields": [int(f) for f in md.fieldsforscan(scan)],
+                    "spws": [int(s) for s in md.spwsforscan(scan)],
+                    "antennas": [int(a) for a in md.antennasforscan(scan)],
+                    "intents": [str(i) for i in md.intentsforscan(scan)],
+                }
+            )
+    finally:
+        md.done()
+    return index
+
+
+def get_index(vis, rebuild=False):
+    """Metadata index of a measurement set, built once and cached
+
+    The index is stored in {vis}.meta.json and rebuilt when the MS
+    subtables change.
+
+    Parameters
+    ----------
+        vis: str
+        rebuild: bool
+            Ignore any cached index (default: False)
+
+    Returns
+    -------
+        dict: nrows, antennas, spws, datadesc_spw, fields, scans
+    """
+    key = ms_key(vis)
+    if not rebuild and _memo.get(vis, {}).get("key") == key:
+        return _memo[vis]
+    if not rebuild and os.path.isfile(index_file(vis)):
+        with open(index_file(vis)) as f:
+            index = json.load(f)
+        if index.get("key") == key:
+            _memo[vis] = index
+            return index
+
+    index = build_index(vis)
+    index["key"] = key
+    with open(index_file(vis), "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    _memo[vis] = index
+    return index
+
+
+def invalidate(vis):
+    """Drop the cached index of a measurement set"""
+    _memo.pop(vis, None)
+    if os.path.isfile(index_file(vis)):
+        os.remove(index_file(vis))
+
+
+def nchan(index):
+    """Number of channels per spectral window"""
+    return [spw["nchan"] for spw in index["spws"]]
+
+
+def chunk_rows(nchan, bytes_per_value, ncorr=4, max_bytes=None):
+    """Rows per read keeping the arrays of a chunk to about max_bytes
+
+    Parameters
+    ----------
+        nchan: int
+            largest number of channels of the rows read
+        bytes_per_value: int
+            memory held per visibility (correlation and channel) by the
+            columns read and the arrays derived from them
+        ncorr: int
+            (default: 4)
+        max_bytes: int
+            (default: chunk_bytes)
+    """
+    per_row = max(1, nchan * ncorr * bytes_per_value)
+    return max(1, (max_bytes or chunk_bytes) // per_row)
+
+
+def scan_starts(index):
+    """Scan number -> start time (MJD seconds)"""
+    return {s["scan"]: s["start"] for s in index["scans"]}
+
+
+def field_id(index, field):
+    """Id of a field given by name or id"""
+    field = int(field) if str(field).isdigit() else field
+    return index["fields"].index(field) if isinstance(field, str) else field
+
+
+def scans_for_field(index, field):
+    """Scans observing a field, given by name or id"""
+    fid = field_id(index, field)
+    return [s for s in index["scans"] if fid in s["fields"]]
+
+
+def calibrator_fields(index):
+    """Fields only observed with calibration intents"""
+    calibrators = []
+    for fid, field in enumerate(index["fields"]):
+        intents = {i for s in scans_for_field(index, fid) for i in s["intents"]}
+        if intents and all("CALIBRATE" in i for i in intents):
+            calibrators.append(field)
+    return calibrators
+
+
+def timerange(scan):
+    """CASA timerange string covering a scan of the index"""
+    start, end = mjd_to_casa([scan["start"], scan["end"]])
+    return f"{start}~{end}"
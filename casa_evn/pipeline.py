@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import hashlib
+
+# Files up to this size are hashed in full, larger ones (FITS-IDI, MS
+# columns) are sampled at both ends together with their size and mtime.
+full_hash_limit = 64 * 1024**2
+sample_size = 1024**2
+
+
+def _hash_file(path, h):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size <= full_hash_limit:
+            for block in iter(lambda: f.read(sample_size), b""):
+                h.update(block)
+        else:
+            h.update(f"{size}:{os.stat(path).st_mtime_ns}".encode())
+            h.update(f.read(sample_size))
+            f.seek(-sample_size, os.SEEK_END)
+            h.update(f.read(sample_size))
+
+
+def fingerprint(path):
+    """Fingerprint a file or a directory (e.g. a measurement set)
+
+    Parameters
+    ----------
+        path: str
+
+    Returns
+    -------
+        str: hex digest, or None if path does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                p = os.path.join(root, name)
+                st = os.stat(p)
+                rel = os.path.relpath(p, path)
+                h.update(f"{rel}:{st.st_size}:{st.st_mtime_ns};".encode())
+    else:
+        _hash_file(path, h)
+    return h.hexdigest()
+
+
+def load_state(statefile):
+    if os.path.isfile(statefile):
+        with open(statefile) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(statefile, state):
+    tmp = f"{statefile}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, statefile)
+
+
+def get_producers(order, steps):
+    """Map each step input to the latest earlier step writing it
+
+    Parameters
+    ----------
+        order: list
+            full, ordered list of step names
+        steps: dict
+            step name -> {"inputs": [...], "outputs": [...], ...}
+
+    Returns
+    -------
+        dict: step name -> {input path: producing step name}
+    """
+    producers = {}
+    last_writer = {}
+    for name in order:
+        producers[name] = {
+            p: last_writer[p] for p in steps[name]["inputs"] if p in last_writer
+        }
+        for p in steps[name]["outputs"]:
+            last_writer[p] = name
+    return producers
+
+
+def logical_path(path, aliases=None):
+    """Path as recorded in the state, aliases mapping directory prefixes
+
+    Lets the data be staged elsewhere (see calibration.run_steps, scratch)
+    without changing the keys of the steps.
+    """
+    for src, dst in (aliases or {}).items():
+        if path == src or path.startswith(src.rstrip(os.sep) + os.sep):
+            return dst + path[len(src) :]
+    return path
+
+
+def step_key(name, steps, producers, state, aliases=None):
+    """Key identifying the inputs of a step
+
+    Inputs written by an earlier step are identified by that step's
+    completion stamp (the measurement set is modified in place by several
+    steps), all other inputs by their content fingerprint. The optional
+    "params" entry of the step, a JSON-serialisable dict of the parameters
+    the step is run with, is part of the key too.
+    """
+    h = hashlib.sha1(name.encode())
+    params = steps[name].get("params")
+    if params:
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    for p in sorted(steps[name]["inputs"]):
+        producer = producers[name].get(p)
+        if producer is not None:
+            token = f"step:{producer}:{state.get(producer, {}).get('stamp')}"
+        else:
+            token = f"file:{fingerprint(p)}"
+        h.update(f"{logical_path(p, aliases)}={token};".encode())
+    return h.hexdigest()
+
+
+def get_dependencies(order, steps):
+    """Steps each step has to wait for
+
+    A step depends on the latest earlier writer of each of its inputs and
+    outputs, on every earlier reader of its outputs since that writer, and
+    on the earlier steps listed in its optional "after" entry.
+
+    Returns
+    -------
+        dict: step name -> set of step names
+    """
+    deps = {}
+    last_writer = {}
+    readers = {}
+    for name in order:
+        step = steps[name]
+        touched = step["inputs"] + step["outputs"]
+        d = {last_writer[p] for p in touched if p in last_writer}
+        d.update(n for n in step.get("after", ()) if n in deps)
+        for p in step["outputs"]:
+            d.update(readers.get(p, ()))
+        deps[name] = d - {name}
+        for p in step["inputs"]:
+            readers.setdefault(p, set()).add(name)
+        for p in step["outputs"]:
+            last_writer[p] = name
+            readers[p] = set()
+    return deps
+
+
+def is_up_to_date(name, steps, producers, state, aliases=None):
+    record = state.get(name)
+    if record is None:
+        return False
+    if not all(os.path.exists(p) for p in steps[name]["outputs"]):
+        return False
+    return record["key"] == step_key(name, steps, producers, state, aliases)
+
+
+def mark_done(name, steps, producers, state, elapsed, aliases=None):
+    # The stamp only changes when the outputs do, so rerunning a step
+    # without effect does not invalidate the steps after it.
+    h = hashlib.sha1(name.encode())
+    for p in sorted(steps[name]["outputs"]):
+        h.update(f"{logical_path(p, aliases)}={fingerprint(p)};".encode())
+    state[name] = {
+        "key": step_key(name, steps, producers, state, aliases),
+        "stamp": h.hexdigest(),
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+def plan(order, steps, selected, statefile, force=False):
+    """What run_pipeline would do, without running anything
+
+    A step whose inputs are written by a step that is going to run is
+    planned to run too, its inputs being likely to change.
+
+    Returns
+    -------
+        list: one dict per step, in order: name, desc, action ('run',
+        'skip' or 'unselected'), reason, inputs, outputs, after (steps it
+        waits for)
+    """
+    state = load_state(statefile)
+    producers = get_producers(order, steps)
+    deps = get_dependencies(order, steps)
+    to_run = set()
+    entries = []
+    for name in order:
+        step = steps[name]
+        upstream = [p for p in producers[name].values() if p in to_run]
+        if name not in selected:
+            action, reason = "unselected", ""
+        elif force:
+            action, reason = "run", "forced"
+        elif name not in state:
+            action, reason = "run", "never completed"
+        elif not all(os.path.exists(p) for p in step["outputs"]):
+            action, reason = "run", "outputs missing"
+        elif upstream:
+            action, reason = "run", f"after {', '.join(sorted(set(upstream)))}"
+        elif not is_up_to_date(name, steps, producers, state):
+            action, reason = "run", "inputs changed"
+        else:
+            action, reason = "skip", "up to date"
+        if action == "run":
+            to_run.add(name)
+        entries.append(
+            {
+                "name": name,
+                "desc": step["desc"],
+                "action": action,
+                "reason": reason,
+                "inputs": list(step["inputs"]),
+                "outputs": list(step["outputs"]),
+                "after": sorted(deps[name], key=order.index),
+            }
+        )
+    return entries
+
+
+def print_plan(entries, paths=True):
+    """Print a plan (see plan), with the inputs and outputs of each step
+
+    The estimated time and bytes written are shown for the steps to run
+    when the plan has them (see planner.estimate).
+    """
+    marks = {"run": "▶️ ", "skip": "✅", "unselected": "  "}
+    for e in entries:
+        reason = f" ({e['reason']})" if e["reason"] else ""
+        line = f"{marks[e['action']]} {e['name']:<22}{e['action'] + reason:<36}"
+        if e["action"] == "run" and e.get("wall_s") is not None:
+            mb = e["bytes_written"] / 1024**2
+            line += f"~{e['wall_s']:.0f} s, {mb:.0f} MB written"
+        print(line.rstrip())
+        if paths and e["action"] == "run":
+            for p in e["inputs"]:
+                print(f"      < {p}")
+            for p in e["outputs"]:
+                print(f"      > {p}")
+    n = sum(e["action"] == "run" for e in entries)
+    print(f"{n} of {len(entries)} steps to run")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def run_pipeline(
+    order,
+    steps,
+    selected,
+    statefile,
+    force=False,
+    verbose=True,
+    max_concurrency=1,
+    aliases=None,
+):
+    """Run the selected steps, skipping those whose inputs did not change
+
+    Independent steps run concurrently in a thread pool, the CASA tasks
+    doing their work outside of the Python interpreter.
+
+    A step may return the names of later steps whose effect it reproduced
+    on the data it added (see funcs.import_fits_idi); those that were up to
+    date before it ran are recorded as up to date again.
+
+    Parameters
+    ----------
+        order: list
+            full, ordered list of step names
+        steps: dict
+            step name -> {"run": callable, "inputs": list, "outputs": list,
+            "desc": str, "after": list (optional), "params": dict
+            (optional, see step_key)}
+        selected: list
+            names of the steps to be run
+        statefile: str
+            JSON file recording completed steps
+        force: bool
+            Run the selected steps even if up to date (default: False)
+        verbose: bool
+        max_concurrency: int
+            Maximum number of steps running at once (default: 1)
+        aliases: dict
+            directory -> directory it stands for in the state, see
+            logical_path (default: None)
+
+    Raises
+    ------
+        the first exception of a failed step, once the steps running
+        alongside it have finished and been recorded
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    state = load_state(statefile)
+    producers = get_producers(order, steps)
+    deps = get_dependencies(order, steps)
+    pending = list(order)
+    done = set()
+    running = {}
+
+    error = None
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        # After a failure no step is started; those running are waited for
+        # and recorded before the error is raised
+        while (pending and error is None) or running:
+            ready = [n for n in pending if deps[n] <= done]
+            for name in ready if error is None else []:
+                if len(running) >= max_concurrency:
+                    break
+                pending.remove(name)
+                step = steps[name]
+                if name not in selected:
+                    done.add(name)
+                elif not force and is_up_to_date(
+                    name, steps, producers, state, aliases
+                ):
+                    if verbose:
+                        print(f"✅ {step['desc']}: inputs unchanged, skipping")
+                    done.add(name)
+                else:
+                    if verbose:
+                        print(step["desc"])
+                    running[pool.submit(_timed, step["run"])] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    if verbose:
+                        print(f"🛑 {steps[name]['desc']}: {future.exception()}")
+                    error = error or future.exception()
+                    continue
+                elapsed, carried = future.result()
+                if not isinstance(carried, (list, tuple, set)):
+                    carried = ()
+                carried = [
+                    n
+                    for n in order
+                    if n in carried
+                    and is_up_to_date(n, steps, producers, state, aliases)
+                ]
+                mark_done(name, steps, producers, state, elapsed, aliases)
+                for n in carried:
+                    elapsed = state[n]["elapsed_s"]
+                    mark_done(n, steps, producers, state, elapsed, aliases)
+                    if verbose:
+                        print(f"✅ {steps[n]['desc']}: replayed on the new data")
+                save_state(statefile, state)
+                done.add(name)
+    if error is not None:
+        raise error
+    return state
@@ -0,0 +1,214 @@
+import os
+import json
+import numpy as np
+from . import idi as _idi
+from . import flagging as _fl
+from . import validation as _val
+
+# Size the cost of each step scales with, a key of experiment_features;
+# the other steps go through the visibilities of the MS
+step_drivers = {
+    "unzip_gz": "gz_bytes",
+    "validate": "idi_bytes",
+    "check_tsys_gaincurve": "idi_bytes",
+    "convert_flag": "nflags",
+    "import_fits_idi": "idi_bytes",
+}
+default_driver = "nvis"
+metrics = ("wall_s", "bytes_written")
+
+
+def experiment_features(idifiles, uvflgfile=None, gzfiles=(), cache=None):
+    """Sizes of the inputs of an experiment, read from the file headers
+
+    Parameters
+    ----------
+        idifiles: list
+        uvflgfile: str
+            AIPS UVFLG file, for the number of flag commands (default: None)
+        gzfiles: list
+            compressed calibration files still to be unzipped
+        cache: str
+            FITS-IDI header cache, see idi.inspect
+
+    Returns
+    -------
+        dict: idi_bytes, gz_bytes, rows (UV_DATA), nspw, nchan, nstokes,
+        nvis, nflags, ms_bytes (estimated size of the MS)
+    """
+    idifiles = [f for f in idifiles if os.path.isfile(f)]
+    infos = _idi.inspect(idifiles, cache=cache) if idifiles else {}
+    first = next(iter(infos.values()), {})
+    nspw, nchan, nstokes = (first.get(k) or 1 for k in ("nspw", "nchan", "nstokes"))
+    rows = sum(i["extensions"].get("UV_DATA", 0) for i in infos.values())
+    nflags = 0
+    if uvflgfile is not None and os.path.isfile(uvflgfile):
+        nflags = len(_fl.parse_uvflg(uvflgfile, nspw, nchan)["ant"])
+    return {
+        "idi_bytes": sum(os.path.getsize(f) for f in idifiles),
+        "gz_bytes": sum(os.path.getsize(f) for f in gzfiles if os.path.isfile(f)),
+        "rows": rows,
+        "nspw": nspw,
+        "nchan": nchan,
+        "nstokes": nstokes,
+        "nvis": rows * nspw * nchan * nstokes,
+        "nflags": nflags,
+        "ms_bytes": _val.estimate_ms_bytes(infos),
+    }
+
+
+def read_samples(tracefiles):
+    """Step records of traced runs, each with the features of its run
+
+    A run ends with a record of kind 'run' holding the experiment features
+    (see calibration.run_steps); steps of runs without one are left out.
+
+    Returns
+    -------
+        list: (step record, features)
+    """
+    samples = []
+    for tracefile in tracefiles:
+        steps = []
+        with open(tracefile) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["kind"] == "step" and record["status"] == "ok":
+                    steps.append(record)
+                elif record["kind"] == "run":
+                    samples += [(s, record["features"]) for s in steps]
+                    steps = []
+    return samples
+
+
+def _fit_line(x, y):
+    """Intercept and slope of y = a + b x, both non-negative
+
+    Falls back to a proportional model when the least-squares line has a
+    negative term, e.g. with too few or too noisy samples.
+    """
+    x, y = np.asarray(x, float), np.asarray(y, float)
+    if len(np.unique(x)) > 1:
+        b, a = np.polyfit(x, y, 1)
+        if a >= 0 and b >= 0:
+            return float(a), float(b)
+    if x.sum() > 0:
+        return 0.0, float(y.sum() / x.sum())
+    return float(y.mean()), 0.0
+
+
+def fit_model(tracefiles):
+    """Per step linear model of wall time and bytes written
+
+    Parameters
+    ----------
+        tracefiles: list
+            {experiment}.trace.jsonl files of instrumented runs
+
+    Returns
+    -------
+        dict: step name -> {driver, samples, wall_s: [a, b],
+        bytes_written: [a, b]}, the metric being a + b * driver size
+    """
+    by_step = {}
+    for record, features in read_samples(tracefiles):
+        by_step.setdefault(record["name"], []).append((record, features))
+    model = {}
+    for name, samples in by_step.items():
+        driver = step_drivers.get(name, default_driver)
+        x = [features.get(driver, 0) for _, features in samples]
+        model[name] = {"driver": driver, "samples": len(samples)}
+        for metric in metrics:
+            y = [record.get(metric) or 0 for record, _ in samples]
+            model[name][metric] = list(_fit_line(x, y))
+    return model
+
+
+def save_model(model, modelfile):
+    with open(modelfile, "w") as f:
+        json.dump(model, f, indent=1)
+
+
+def load_model(modelfile):
+    with open(modelfile) as f:
+        return json.load(f)
+
+
+def estimate(entries, features, model):
+    """Add the estimated wall_s and bytes_written to the steps of a plan
+
+    Steps the model has no samples of get None.
+
+    Parameters
+    ----------
+        entries: list
+            see pipeline.plan
+        features: dict
+            see experiment_features
+        model: dict
+            see fit_model
+
+    Returns
+    -------
+        dict: totals over the steps to run, wall_s (one step at a time),
+        critical_s (critical path, with unlimited concurrency),
+        bytes_written, ms_bytes, unknown (steps without estimate)
+    """
+    finish = {}
+    totals = {"wall_s": 0.0, "critical_s": 0.0, "bytes_written": 0.0}
+    unknown = []
+    for e in entries:
+        fit = model.get(e["name"])
+        x = features.get(step_drivers.get(e["name"], default_driver), 0)
+        for metric in metrics:
+            e[metric] = None if fit is None else fit[metric][0] + fit[metric][1] * x
+        if e["action"] != "run":
+            continue
+        if fit is None:
+            unknown.append(e["name"])
+            continue
+        start = max((finish.get(n, 0.0) for n in e["after"]), default=0.0)
+        finish[e["name"]] = start + e["wall_s"]
+        totals["wall_s"] += e["wall_s"]
+        totals["bytes_written"] += e["bytes_written"]
+    totals["critical_s"] = max(finish.values(), default=0.0)
+    totals["ms_bytes"] = features["ms_bytes"]
+    totals["unknown"] = unknown
+    return totals
+
+
+def print_totals(totals):
+    """Print the totals of an estimated plan (see estimate)"""
+    gb = lambda n: f"{n / 1024**3:.1f} GB"
+    print(
+        f"Estimated wall time: {totals['wall_s']:.0f} s one step at a time, "
+        f"{totals['critical_s']:.0f} s on the critical path"
+    )
+    print(
+        f"Estimated disk: MS of about {gb(totals['ms_bytes'])}, "
+        f"{gb(totals['bytes_written'])} written"
+    )
+    if totals["unknown"]:
+        print(f"⚠️  No previous runs of {', '.join(totals['unknown'])}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Fit the step cost model on traced runs"
+    )
+    parser.add_argument("tracefile", nargs="+", type=str, help="trace.jsonl files")
+    parser.add_argument(
+        "-o", "--output", type=str, default="cost_model.json", help="model file"
+    )
+    args = parser.parse_args()
+
+    model = fit_model(args.tracefile)
+    save_model(model, args.output)
+    for name, fit in model.items():
+        a, b = fit["wall_s"]
+        print(
+            f"{name:<22}{fit['samples']:>4} runs  wall = {a:.1f} s + "
+            f"{b:.3g} s x {fit['driver']}"
+        )
@@ -0,0 +1,105 @@
+import os
+import glob
+import shutil
+
+
+def _tree(path):
+    """Files and links under path, relative path -> (size, mtime_ns) or link
+
+    A file or a link is its own tree, with the relative path '.'.
+    """
+    if os.path.islink(path) or os.path.isfile(path):
+        return {".": _entry(path)}
+    tree = {}
+    for root, dirs, files in os.walk(path):
+        for name in files + [d for d in dirs if os.path.islink(f"{root}/{d}")]:
+            p = os.path.join(root, name)
+            tree[os.path.relpath(p, path)] = _entry(p)
+    return tree
+
+
+def _entry(path):
+    if os.path.islink(path):
+        return ("link", os.readlink(path))
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _remove(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def sync(src, dst, max_workers=4, remove=True):
+    """Make dst a copy of src, copying only the files that differ
+
+    Files are compared by size and mtime, which shutil.copy2 keeps, so the
+    fingerprints of the pipeline (see pipeline.fingerprint) are the same
+    on both sides. Symbolic links (the calibration tables, see caltables)
+    are copied as links. With remove, dst is removed if src does not
+    exist.
+
+    Parameters
+    ----------
+        src, dst: str
+            files or directories
+        max_workers: int
+            Number of files copied at once (default: 4)
+        remove: bool
+            Remove what is in dst only (default: True); otherwise the
+            files of src are copied over dst and nothing is removed
+
+    Returns
+    -------
+        int: bytes copied
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not os.path.lexists(src):
+        if remove:
+            _remove(dst)
+        return 0
+    single = os.path.islink(src) or os.path.isfile(src)
+    if os.path.lexists(dst) and single != (os.path.islink(dst) or os.path.isfile(dst)):
+        _remove(dst)
+    new, old = _tree(src), _tree(dst) if os.path.lexists(dst) else {}
+    for rel in set(old) - set(new) if remove else ():
+        _remove(os.path.normpath(f"{dst}/{rel}"))
+    changed = [rel for rel in new if old.get(rel) != new[rel]]
+
+    def copy(rel):
+        source = os.path.normpath(f"{src}/{rel}")
+        target = os.path.normpath(f"{dst}/{rel}")
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        _remove(target)
+        if new[rel][0] == "link":
+            os.symlink(new[rel][1], target)
+            return 0
+        shutil.copy2(source, target)
+        return new[rel][0]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return sum(pool.map(copy, changed))
+
+
+def mirror(patterns, src, dst, max_workers=4, remove=True):
+    """Sync the entries of src matching patterns to dst, see sync
+
+    Entries matching in dst only are removed, unless remove is False.
+
+    Returns
+    -------
+        int: bytes copied
+    """
+    names = set()
+    for directory in (src, dst):
+        for pattern in patterns:
+            paths = glob.glob(f"{directory}/{pattern}")
+            names.update(os.path.basename(p) for p in paths)
+    os.makedirs(dst, exist_ok=True)
+    return sum(
+        sync(f"{src}/{name}", f"{dst}/{name}", max_workers=max_workers, remove=remove)
+        for name in sorted(names)
+    )
@@ -0,0 +1,303 @@
+import numpy as np
+from . import metadata as _md
+
+# Memory per visibility of delay_spectra: DATA and FLAG, then per parallel
+# hand (two of four correlations) a 4x zero-padded complex64 spectrum and
+# its float32 amplitude and normalisation
+delay_bytes_per_value = 8 + 1 + (4 * (8 + 4 + 4)) // 2
+# Memory per visibility of the other passes: DATA, FLAG and a masked copy
+pass_bytes_per_value = 8 + 1 + 8
+
+
+def _fft(vis, n):
+    """FFT along the channels in single precision
+
+    numpy.fft always returns complex128; scipy.fft keeps complex64.
+    """
+    try:
+        from scipy import fft
+    except ImportError:
+        return np.fft.fft(vis, n=n, axis=1).astype(np.complex64)
+    return fft.fft(vis.astype(np.complex64, copy=False), n=n, axis=1)
+
+
+def _parallel_hands(ncorr):
+    # RR, LL of RR, RL, LR, LL; both of RR, LL
+    return [0, ncorr - 1] if ncorr in (2, 4) else [0]
+
+
+def delay_spectra(data, flag):
+    """Normalised delay amplitude spectrum of each row
+
+    The flagged channels are zeroed, the spectrum of each row is Fourier
+    transformed to delay and divided by its median amplitude, then averaged
+    over the parallel hands.
+
+    Parameters
+    ----------
+        data, flag: array
+            (ncorr, nchan, nrow), as returned by the table tool
+
+    Returns
+    -------
+        array: (nrow, nfft)
+    """
+    corr = _parallel_hands(data.shape[0])
+    vis = np.where(flag[corr], 0, data[corr])
+    spec = np.abs(_fft(vis, 4 * vis.shape[1]))
+    noise = np.median(spec, axis=1, keepdims=True)
+    spec = np.where(noise > 0, spec / np.where(noise > 0, noise, 1), 0)
+    return spec.mean(axis=0).T
+
+
+def peak_snr(spectra):
+    """SNR of the peak of (averaged) delay spectra, along the last axis"""
+    std = spectra.std(axis=-1)
+    peak = spectra.max(axis=-1) - spectra.mean(axis=-1)
+    return np.where(std > 0, peak / np.where(std > 0, std, 1), 0)
+
+
+def scan_snr(vis, refant, scans, datacolumn="DATA", chunksize=None):
+    """Stream the baselines to refant scan by scan and compute SNR proxies
+
+    Delay spectra are averaged incoherently per antenna and spectral
+    window over the scan, so that the SNR of a persistent delay peak grows
+    with the number of integrations.
+
+    Parameters
+    ----------
+        vis: str
+        refant: str
+        scans: list
+            scans of the metadata index
+        datacolumn: str
+            (default: 'DATA')
+        chunksize: int
+            number of rows per read (default: None, about
+            metadata.chunk_bytes of data and spectra)
+
+    Returns
+    -------
+        dict: scan number -> (snr, time, row_snr), snr mapping antenna
+        index -> SNR proxy over the scan, time and row_snr per row
+    """
+    from casatools import table
+
+    index = _md.get_index(vis)
+    ref = index["antennas"].index(refant)
+    nant, ndd = len(index["antennas"]), len(index["datadesc_spw"])
+    nchan = max(_md.nchan(index), default=1)
+    chunksize = chunksize or _md.chunk_rows(nchan, delay_bytes_per_value)
+    tb = table()
+    tb.open(vis)
+    results = {}
+    for scan in scans:
+        sub = tb.query(
+            f"SCAN_NUMBER=={scan['scan']} && ANTENNA1!=ANTENNA2 "
+            f"&& (ANTENNA1=={ref} || ANTENNA2=={ref})"
+        )
+        spectra, counts = None, np.zeros((nant, ndd))
+        times, row_snr = [], []
+        for startrow in range(0, sub.nrows(), chunksize):
+            nrow = min(chunksize, sub.nrows() - startrow)
+            get = lambda col: sub.getcol(col, startrow=startrow, nrow=nrow)
+            a1, a2, dd = get("ANTENNA1"), get("ANTENNA2"), get("DATA_DESC_ID")
+            ant = np.where(a1 == ref, a2, a1)
+            spec = delay_spectra(get(datacolumn), get("FLAG"))
+            if spectra is None:
+                spectra = np.zeros((nant, ndd, spec.shape[1]))
+            np.add.at(spectra, (ant, dd), spec)
+            np.add.at(counts, (ant, dd), 1)
+            times.append(get("TIME"))
+            row_snr.append(peak_snr(spec))
+        sub.close()
+        if spectra is None:
+            continue
+        present = counts > 0
+        snr = np.zeros((nant, ndd))
+        snr[present] = peak_snr(spectra[present] / counts[present][:, None])
+        antennas = np.flatnonzero(present.any(axis=1))
+        snr = {a: float(snr[a][present[a]].mean()) for a in antennas}
+        results[scan["scan"]] = (snr, np.concatenate(times), np.concatenate(row_snr))
+    tb.close()
+    return results
+
+
+def _best_window(time, snr, duration):
+    """Start and end of the window of length duration with the highest SNR"""
+    t, inverse = np.unique(time, return_inverse=True)
+    power = np.bincount(inverse, weights=snr**2)
+    cumulative = np.concatenate([[0], np.cumsum(power)])
+    end = np.searchsorted(t, t + duration, side="right")
+    best = np.argmax(cumulative[end] - cumulative[: len(t)])
+    return t[best], t[end[best] - 1]
+
+
+def find_fringe_scan(
+    vis, refant, fields=None, duration=None, minsnr=5.0, datacolumn="DATA"
+):
+    """Pick the best scan and time range for single-band delay fringe fitting
+
+    Each scan is scored by the number of antennas whose baseline to refant
+    shows a delay-spectrum SNR proxy above minsnr, then by the median SNR
+    over those baselines. The DATA column is read in chunks, one scan at a
+    time, without going through plotms.
+
+    Parameters
+    ----------
+        vis: str
+        refant: str
+        fields: list
+            candidate fields (names or ids, default: all)
+        duration: float
+            length [s] of the returned time range, picked within the scan to
+            maximise the SNR (default: the whole scan)
+        minsnr: float
+            SNR proxy above which a baseline counts as detected (default: 5)
+        datacolumn: str
+            (default: 'DATA')
+
+    Returns
+    -------
+        dict: scan, field, timerange, score, snr (antenna name -> SNR proxy)
+    """
+    index = _md.get_index(vis)
+    if fields is None:
+        scans = index["scans"]
+    else:
+        scans = [s for f in fields for s in _md.scans_for_field(index, f)]
+
+    results = scan_snr(vis, refant, scans, datacolumn)
+    best = None
+    for scan in scans:
+        if scan["scan"] not in results:
+            continue
+        snr, time, row_snr = results[scan["scan"]]
+        per_antenna = {index["antennas"][a]: v for a, v in snr.items()}
+        values = np.array(list(per_antenna.values()))
+        detected = values[values > minsnr]
+        score = (len(detected), float(np.median(detected)) if len(detected) else 0.0)
+        if best is None or score > best["score"]:
+            if duration:
+                start, end = _best_window(time, row_snr, duration)
+                window = {"start": start, "end": end}
+            else:
+                window = scan
+            best = {
+                "scan": scan["scan"],
+                "field": index["fields"][scan["fields"][0]],
+                "timerange": _md.timerange(window),
+                "score": score,
+                "snr": per_antenna,
+            }
+
+    if best is None:
+        print(f"🛑 No scan with baselines to {refant} found")
+        return None
+    print(
+        f"✅ Fringe finder scan {best['scan']} ({best['field']}), "
+        f"{best['timerange']}: {best['score'][0]} antennas detected, "
+        f"median SNR {best['score'][1]:.1f}"
+    )
+    return best
+
+
+def antenna_statistics(vis, datacolumn="DATA", chunksize=None):
+    """Data quality per antenna from a single chunked pass over the MS
+
+    Chunks hold about metadata.chunk_bytes unless chunksize (rows) is given.
+
+    Returns
+    -------
+        dict: antenna name -> unflagged (fraction of unflagged cross-
+        correlation visibilities), baselines (number of baselines with
+        unflagged data), scans (fraction of scans with unflagged data),
+        amplitude (median of the channel-averaged unflagged amplitudes)
+    """
+    from casatools import table
+
+    index = _md.get_index(vis)
+    nant = len(index["antennas"])
+    scan_numbers = np.array([s["scan"] for s in index["scans"]])
+    good, total = np.zeros(nant), np.zeros(nant)
+    baselines = np.zeros((nant, nant), dtype=bool)
+    scans = np.zeros((nant, len(scan_numbers)), dtype=bool)
+    amplitudes = [[] for _ in range(nant)]
+    nchan = max(_md.nchan(index), default=1)
+    chunksize = chunksize or _md.chunk_rows(nchan, pass_bytes_per_value)
+
+    tb = table()
+    tb.open(vis)
+    for ddid in range(len(index["datadesc_spw"])):
+        sub = tb.query(f"DATA_DESC_ID=={ddid} && ANTENNA1!=ANTENNA2")
+        for startrow in range(0, sub.nrows(), chunksize):
+            nrow = min(chunksize, sub.nrows() - startrow)
+            get = lambda col: sub.getcol(col, startrow=startrow, nrow=nrow)
+            a1, a2 = get("ANTENNA1"), get("ANTENNA2")
+            flag = get("FLAG")
+            unflagged = (~flag).sum(axis=(0, 1))
+            amp = np.abs(np.where(flag, 0, get(datacolumn))).sum(axis=(0, 1))
+            amp = amp / np.maximum(unflagged, 1)
+            scan = np.searchsorted(scan_numbers, get("SCAN_NUMBER"))
+            has_data = unflagged > 0
+            for a in (a1, a2):
+                np.add.at(good, a, unflagged)
+                np.add.at(total, a, flag.shape[0] * flag.shape[1])
+                scans[a[has_data], scan[has_data]] = True
+            baselines[a1[has_data], a2[has_data]] = True
+            for a in np.unique(np.concatenate([a1, a2])):
+                rows = has_data & ((a1 == a) | (a2 == a))
+                amplitudes[a].append(amp[rows])
+        sub.close()
+    tb.close()
+
+    baselines |= baselines.T
+    return {
+        name: {
+            "unflagged": float(good[a] / total[a]) if total[a] > 0 else 0.0,
+            "baselines": int(baselines[a].sum()),
+            "scans": float(scans[a].mean()) if len(scan_numbers) else 0.0,
+            "amplitude": (
+                float(np.median(np.concatenate(amplitudes[a])))
+                if amplitudes[a]
+                else 0.0
+            ),
+        }
+        for a, name in enumerate(index["antennas"])
+    }
+
+
+def rank_refants(vis, datacolumn="DATA"):
+    """Rank antennas as reference antenna candidates
+
+    The score is the product of the unflagged fraction, the fraction of
+    possible baselines and the scan coverage, weighted by the square root
+    of the median amplitude relative to the highest one, so that large,
+    sensitive dishes are preferred among equally well-covered antennas.
+
+    Returns
+    -------
+        list: antenna names, best first
+        dict: antenna name -> statistics and score
+    """
+    stats = antenna_statistics(vis, datacolumn=datacolumn)
+    nant = len(stats)
+    max_amp = max((s["amplitude"] for s in stats.values()), default=0.0) or 1.0
+    for s in stats.values():
+        s["score"] = (
+            s["unflagged"]
+            * s["baselines"]
+            / max(nant - 1, 1)
+            * s["scans"]
+            * np.sqrt(s["amplitude"] / max_amp)
+        )
+    ranked = sorted(stats, key=lambda a: stats[a]["score"], reverse=True)
+
+    print(f"{'antenna':<8}{'score':>8}{'unflagged':>11}{'baselines':>11}{'scans':>8}")
+    for a in ranked:
+        s = stats[a]
+        print(
+            f"{a:<8}{s['score']:>8.3f}{s['unflagged']:>11.2f}"
+            f"{s['baselines']:>11}{s['scans']:>8.2f}"
+        )
+    return ranked, stats
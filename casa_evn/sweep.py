@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import shutil
+import itertools
+import warnings
+import traceback
+import numpy as np
+from . import metadata as _md
+from . import instrument as _i
+
+
+def param_grid(grid):
+    """All combinations of a grid of parameter values
+
+    Parameters
+    ----------
+        grid: dict
+            parameter name -> list of values
+
+    Returns
+    -------
+        list: one parameter dict per combination
+    """
+    names = list(grid)
+    combinations = itertools.product(*grid.values())
+    return [dict(zip(names, values)) for values in combinations]
+
+
+def solution_statistics(caltable, antennas):
+    """Failed solutions and delay/rate scatter of a fringefit table
+
+    FPARAM holds, per correlation, the phase, delay [ns] and rate [s/s]
+    (and the dispersive delay in recent CASA versions) of each solution.
+
+    Parameters
+    ----------
+        caltable: str
+        antennas: list
+            antenna names, indexed by ANTENNA1
+
+    Returns
+    -------
+        dict: failed (fraction of flagged solutions), per antenna failed,
+        delay_std [ns] and rate_std [ps/s]
+    """
+    from casatools import table
+
+    tb = table()
+    tb.open(caltable)
+    try:
+        fparam, flag = tb.getcol("FPARAM"), tb.getcol("FLAG")
+        antenna = tb.getcol("ANTENNA1")
+    finally:
+        tb.close()
+
+    # (npar, nchan, nrow), 3 or 4 parameters per correlation
+    nper = 4 if fparam.shape[0] % 4 == 0 else 3
+    delay = np.where(flag[1::nper], np.nan, fparam[1::nper])
+    rate = np.where(flag[2::nper], np.nan, fparam[2::nper])
+    stats = {"failed": float(flag.mean()) if flag.size else 1.0, "antennas": {}}
+    for a in np.unique(antenna):
+        rows = antenna == a
+        with warnings.catch_warnings():
+            # all-NaN antennas (only failed solutions) give NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            delay_std = np.nanstd(delay[..., rows])
+            rate_std = np.nanstd(rate[..., rows]) * 1e12
+        stats["antennas"][antennas[a]] = {
+            "failed": float(flag[..., rows].mean()),
+            "delay_std": None if np.isnan(delay_std) else float(delay_std),
+            "rate_std": None if np.isnan(rate_std) else float(rate_std),
+        }
+    return stats
+
+
+def score(stats):
+    """Sort key of a trial, lower is better
+
+    Fewer failed solutions first, then the median delay scatter over the
+    antennas.
+    """
+    if stats is None:
+        return (2.0, np.inf)
+    scatter = [s["delay_std"] for s in stats["antennas"].values()]
+    scatter = [s for s in scatter if s is not None]
+    median = float(np.median(scatter)) if scatter else np.inf
+    return (round(stats["failed"], 2), median)
+
+
+def _run_trial(vis, caltable, base, params, antennas):
+    """Run one fringefit trial; runs in a worker process"""
+    from casatasks import fringefit
+
+    start = time.perf_counter()
+    result = {"params": params, "caltable": caltable, "stats": None, "error": None}
+    try:
+        if os.path.isdir(caltable):
+            shutil.rmtree(caltable)
+        fringefit(vis=vis, caltable=caltable, **{**base, **params})
+        result["stats"] = solution_statistics(caltable, antennas)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    result["wall_s"] = round(time.perf_counter() - start, 1)
+    return result
+
+
+def sweep_fringefit(vis, grid, base, outdir, max_workers=2, report=None):
+    """Run fringefit over a grid of parameter sets in parallel
+
+    Each trial writes its own table to outdir; the MS is only read, so
+    the trials share it. Workers are fresh processes, CASA keeping global
+    state.
+
+    Parameters
+    ----------
+        vis: str
+        grid: dict
+            parameter name -> list of values, e.g. {"minsnr": [5, 50],
+            "solint": ["inf", "60s"], "combine": ["", "spw"]}
+        base: dict
+            fringefit parameters common to all trials (gaintable, refant,
+            timerange, ...)
+        outdir: str
+        max_workers: int
+            Number of trials run at once (default: 2)
+        report: str
+            JSON file the trials are written to (default: None)
+
+    Returns
+    -------
+        list: trials, best first, each with params, caltable, stats, error
+        and wall_s
+    """
+    antennas = _md.get_index(vis)["antennas"]
+    trials = param_grid(grid)
+    os.makedirs(outdir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(vis))[0]
+    with _i.process_pool(max_workers) as pool:
+        futures = [
+            pool.submit(
+                _run_trial, vis, f"{outdir}/{name}.trial{i}", base, params, antennas
+            )
+            for i, params in enumerate(trials)
+        ]
+        results = [future.result() for future in futures]
+
+    results.sort(key=lambda r: score(r["stats"]))
+    summary(results)
+    if report is not None:
+        with open(report, "w") as f:
+            json.dump(results, f, indent=1, default=str)
+    return results
+
+
+def summary(results):
+    """Print the trials, best first, and the recommended parameter set"""
+    params = list(results[0]["params"]) if results else []
+    header = "".join(f"{p[:12]:>13}" for p in params)
+    print(f"{header}{'failed':>8}{'delay std':>11}{'wall[s]':>9}")
+    for r in results:
+        cells = "".join(f"{str(r['params'][p])[:12]:>13}" for p in params)
+        if r["stats"] is None:
+            print(f"{cells}  🛑 {r['error']}")
+            continue
+        failed, scatter = score(r["stats"])
+        print(f"{cells}{failed:>8.2f}{scatter:>11.3f}{r['wall_s']:>9.1f}")
+    if results and results[0]["stats"] is not None:
+        print(f"✅ Recommended: {results[0]['params']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fringefit parameter sweep")
+    parser.add_argument("experiment", type=str, help="project id (in lower case)")
+    parser.add_argument(
+        "-g",
+        "--grid",
+        type=json.loads,
+        default={"minsnr": [5, 50], "solint": ["inf", "60s"]},
+        help='JSON parameter grid, e.g. \'{"minsnr": [5, 50]}\'',
+    )
+    parser.add_argument("-r", "--refant", type=str, default="EF")
+    parser.add_argument(
+        "-t",
+        "--timerange",
+        type=str,
+        default="auto",
+        help="time range, 'auto' to pick it on the best fringe finder scan",
+    )
+    parser.add_argument("-n", "--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    from . import calibration, funcs
+
+    v = calibration.get_variables(
+        args.experiment, refant=args.refant, return_as_dict=True
+    )
+    refant = calibration.resolve_refant(v["vis"], v["refant"])
+    timerange = args.timerange
+    if timerange == "auto":
+        timerange = funcs.find_sbd_timerange(v["vis"], refant.split(",")[0])
+    funcs.sweep_sbd(
+        v["vis"],
+        refant,
+        [v["gcaltab"], v["tsystab"]],
+        f"{os.path.dirname(v['vis'])}/sweep",
+        args.grid,
+        timerange=timerange,
+        max_workers=args.workers,
+    )
@@ -0,0 +1,319 @@
+import os
+import re
+import json
+import shutil
+import numpy as np
+from . import idi as _idi
+from . import flagging as _fl
+
+_doy_time = re.compile(r"^(\d+)\s+(\d+):(\d+(?:\.\d*)?)")
+_gain_freq = re.compile(r"FREQ\s*=\s*([\d.]+)\s*,\s*([\d.]+)", re.IGNORECASE)
+
+# Bytes per visibility of the MS (DATA, CORRECTED_DATA and FLAG) and per row
+# of the main table (ids, times, uvw, weights)
+ms_bytes_per_vis = 8 + 8 + 1
+ms_bytes_per_row = 120
+
+
+def parse_antab(antabfile):
+    """Antennas, gain curve frequency ranges and TSYS time spans of an ANTAB
+
+    Returns
+    -------
+        dict: gain (antenna -> list of [fmin, fmax] in MHz), tsys (antenna
+        -> [first, last] time in fractional day of year)
+    """
+    gain, tsys = {}, {}
+    current = None
+    with open(antabfile) as f:
+        for line in f:
+            line = line.split("!")[0].strip()
+            words = line.split()
+            if not words:
+                continue
+            key = words[0].upper()
+            if key == "GAIN" and len(words) > 1:
+                current = None
+                ant = words[1].upper()
+                freq = _gain_freq.search(line)
+                span = [float(freq.group(1)), float(freq.group(2))] if freq else None
+                gain.setdefault(ant, []).append(span)
+            elif key == "TSYS" and len(words) > 1:
+                current = words[1].upper()
+            elif current is not None:
+                match = _doy_time.match(line)
+                if match:
+                    doy, h, m = (float(x) for x in match.groups())
+                    t = doy + (h + m / 60.0) / 24.0
+                    first, last = tsys.get(current, [t, t])
+                    tsys[current] = [min(first, t), max(last, t)]
+    return {"gain": gain, "tsys": tsys}
+
+
+def _doy(mjd_seconds):
+    """Fractional day of year of an MJD time [s]"""
+    ms = np.round(mjd_seconds * 1000).astype("timedelta64[ms]")
+    t = np.datetime64("1858-11-17", "ms") + ms
+    year = t.astype("datetime64[Y]")
+    return float((t - year) / np.timedelta64(1, "D")) + 1.0
+
+
+class Report:
+    """Checks of a validation, each with a level: ok, warning or error"""
+
+    def __init__(self):
+        self.checks = []
+
+    def add(self, check, level, message):
+        self.checks.append({"check": check, "level": level, "message": message})
+
+    def require(self, check, condition, message, level="error"):
+        self.add(check, "ok" if condition else level, "" if condition else message)
+        return condition
+
+    @property
+    def errors(self):
+        return [c for c in self.checks if c["level"] == "error"]
+
+    def summary(self):
+        marks = {"ok": "✅", "warning": "⚠️ ", "error": "🛑"}
+        for c in self.checks:
+            if c["level"] != "ok":
+                print(f"{marks[c['level']]} {c['check']}: {c['message']}")
+        n = {level: 0 for level in marks}
+        for c in self.checks:
+            n[c["level"]] += 1
+        print(
+            f"Validation: {n['ok']} checks passed, {n['warning']} warnings, "
+            f"{n['error']} errors"
+        )
+
+    def save(self, reportfile):
+        with open(reportfile, "w") as f:
+            json.dump(self.checks, f, indent=1)
+
+
+def check_idifiles(report, infos):
+    """FITS-IDI files share one frequency setup and have the needed tables"""
+    if not infos:
+        return
+    first = next(iter(infos.values()))
+    keys = ("nspw", "nchan", "ref_freq", "bandfreq")
+    setup = lambda info: [info.get(k) for k in keys]
+    for idifile, info in infos.items():
+        name = os.path.basename(idifile)
+        report.require(
+            "idi.tables",
+            all(e in info["extensions"] for e in ("ANTENNA", "FREQUENCY", "UV_DATA")),
+            f"{name} lacks an ANTENNA, FREQUENCY or UV_DATA table",
+        )
+        report.require(
+            "idi.setup",
+            setup(info) == setup(first),
+            f"{name} has a different frequency setup than the first file",
+        )
+
+
+def check_antab(report, antab, infos):
+    """ANTAB antennas, gain curve frequencies and TSYS times versus the IDI"""
+    antennas = {a.upper() for i in infos.values() for _, a in i.get("antennas", [])}
+    missing = sorted(antennas - set(antab["tsys"]))
+    report.require(
+        "antab.tsys_antennas",
+        not missing,
+        f"no TSYS for {', '.join(missing)}",
+        level="warning",
+    )
+    missing = sorted(antennas - set(antab["gain"]))
+    report.require(
+        "antab.gain_antennas",
+        not missing,
+        f"no gain curve for {', '.join(missing)}",
+        level="warning",
+    )
+    unknown = sorted((set(antab["tsys"]) | set(antab["gain"])) - antennas)
+    report.require(
+        "antab.unknown_antennas",
+        not unknown,
+        f"{', '.join(unknown)} not in the FITS-IDI ANTENNA table",
+        level="warning",
+    )
+
+    freqs = [
+        (i["ref_freq"] + f) / 1e6
+        for i in infos.values()
+        if i.get("ref_freq") is not None
+        for f in i.get("bandfreq", [0.0])
+    ]
+    if freqs:
+        lo, hi = min(freqs), max(freqs)
+        outside = sorted(
+            a
+            for a, spans in antab["gain"].items()
+            if a in antennas
+            and spans
+            and all(s is not None and (hi < s[0] or lo > s[1]) for s in spans)
+        )
+        report.require(
+            "antab.gain_frequency",
+            not outside,
+            f"gain curves of {', '.join(outside)} do not cover {lo:.0f}-{hi:.0f} MHz",
+        )
+
+    spans = [(i["start"], i["end"]) for i in infos.values() if "start" in i]
+    if spans:
+        start = _doy(min(s for s, _ in spans))
+        end = _doy(max(e for _, e in spans))
+        outside = sorted(
+            a
+            for a, (first, last) in antab["tsys"].items()
+            if a in antennas and (last < start or first > end)
+        )
+        report.require(
+            "antab.tsys_time",
+            not outside,
+            f"TSYS of {', '.join(outside)} outside the observation "
+            f"(day {start:.3f}-{end:.3f})",
+        )
+
+
+def check_uvflg(report, flags, infos):
+    """UVFLG antennas, times and spw/channel ranges versus the IDI"""
+    first = next(iter(infos.values()))
+    antennas = {a for i in infos.values() for _, a in i.get("antennas", [])}
+    unknown = sorted({a for a in flags["ant"] if a and a not in antennas})
+    report.require(
+        "uvflg.antennas",
+        not unknown,
+        f"flags for {', '.join(unknown)}, not in the FITS-IDI ANTENNA table",
+        level="warning",
+    )
+    nspw, nchan = first.get("nspw"), first.get("nchan")
+    if nspw and nchan:
+        out = (flags["spw1"] >= nspw) | (flags["ch1"] >= nchan)
+        report.require(
+            "uvflg.frequency",
+            not out.any(),
+            f"{out.sum()} flags beyond {nspw} spws x {nchan} channels",
+            level="warning",
+        )
+
+    spans = [(i["start"], i["end"]) for i in infos.values() if "start" in i]
+    if spans and first.get("rdate"):
+        rdate = np.datetime64(first["rdate"], "s") - np.datetime64("1858-11-17", "s")
+        t0 = rdate / np.timedelta64(1, "s")
+        start, end = min(s for s, _ in spans) - t0, max(e for _, e in spans) - t0
+        finite = flags["t1"] >= 0
+        outside = finite & ((flags["t1"] < start) | (flags["t0"] > end))
+        report.require(
+            "uvflg.time",
+            not outside.any() or outside.sum() < finite.sum(),
+            "no flag overlaps the observation, is the reference day right?",
+        )
+        report.require(
+            "uvflg.time",
+            not outside.any(),
+            f"{outside.sum()} of {finite.sum()} flags outside the observation",
+            level="warning",
+        )
+
+
+def estimate_ms_bytes(infos):
+    """Expected size of the MS imported from the FITS-IDI files"""
+    nbytes = 0
+    for i in infos.values():
+        rows = i["extensions"].get("UV_DATA", 0) * (i.get("nspw") or 1)
+        nvis = rows * (i.get("nchan") or 1) * (i.get("nstokes") or 1)
+        nbytes += nvis * ms_bytes_per_vis + rows * ms_bytes_per_row
+    return nbytes
+
+
+def check_disk(report, infos, vis):
+    """Free space in the working directory for the MS"""
+    workdir = os.path.dirname(vis)
+    needed = estimate_ms_bytes(infos)
+    if os.path.isdir(vis):
+        needed -= sum(
+            os.path.getsize(os.path.join(root, f))
+            for root, _, files in os.walk(vis)
+            for f in files
+        )
+    free = shutil.disk_usage(workdir).free
+    gb = lambda n: f"{n / 1024**3:.1f} GB"
+    report.require(
+        "disk.space",
+        free >= needed,
+        f"{gb(free)} free in {workdir}, the MS needs about {gb(needed)}",
+    )
+    report.require(
+        "disk.margin",
+        free >= 1.5 * needed,
+        f"{gb(free)} free in {workdir} leaves little room after the MS "
+        f"(about {gb(needed)})",
+        level="warning",
+    )
+
+
+def validate(antabfile, uvflgfile, gcfile, idifiles, vis, reportfile=None):
+    """Check all inputs of the pipeline against each other, read-only
+
+    The FITS-IDI headers (see idi.inspect), the ANTAB and the UVFLG file
+    are read concurrently.
+
+    Parameters
+    ----------
+        antabfile, uvflgfile, gcfile: str
+        idifiles: list
+        vis: str
+            MS to be written, for the disk space check
+        reportfile: str
+            JSON file the list of checks is written to (default: None)
+
+    Returns
+    -------
+        Report
+
+    Raises
+    ------
+        RuntimeError if any check fails with an error
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    report = Report()
+    for check, path in (
+        ("files.antab", antabfile),
+        ("files.uvflg", uvflgfile),
+        ("files.gc", gcfile),
+    ):
+        report.require(check, os.path.isfile(path), f"{path} not found")
+    report.require("files.idi", len(idifiles) > 0, "no FITS-IDI files found")
+    idifiles = [f for f in idifiles if os.path.isfile(f)]
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        antab = None
+        if os.path.isfile(antabfile):
+            antab = pool.submit(parse_antab, antabfile)
+        infos = _idi.inspect(idifiles)
+        antab = antab.result() if antab is not None else None
+
+    check_idifiles(report, infos)
+    if infos:
+        first = next(iter(infos.values()))
+        if antab is not None:
+            check_antab(report, antab, infos)
+        if os.path.isfile(uvflgfile):
+            antenna_names = {n: name for n, name in first.get("antennas", [])}
+            nspw, nchan = first.get("nspw") or 1, first.get("nchan") or 1
+            flags = _fl.parse_uvflg(uvflgfile, nspw, nchan, antenna_names)
+            check_uvflg(report, flags, infos)
+        check_disk(report, infos, vis)
+
+    report.summary()
+    if reportfile is not None:
+        report.save(reportfile)
+    if report.errors:
+        raise RuntimeError(
+            f"{len(report.errors)} validation errors: "
+            + "; ".join(c["message"] for c in report.errors)
+        )
+    return report